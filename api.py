@@ -0,0 +1,419 @@
+"""HTTP API for MD2PDF, for tools that cannot drive the Streamlit page.
+
+Jobs go through the same queue, conversion engine and option mapping as the UI:
+
+    POST   /jobs           multipart/form-data: one or more "files" parts (.md or
+                           .zip, in document order) plus option fields; returns
+                           202 with the job id
+    GET    /jobs/<id>      job status, progress and, once finished, the result
+    GET    /jobs/<id>/pdf  the finished PDF
+    DELETE /jobs/<id>      cancel a queued or running job
+
+Option fields match the PdfOptions fields in converter.py (title, author, date,
+font_family, font_size, margin, code_font_size, line_numbers,
+gray_code_background, title_page, toc, parallel_chapters, auto_fix); booleans
+accept true/false, 1/0, yes/no and on/off.
+
+serve.py serves the API next to the Streamlit page on MD2PDF_API_PORT when it is
+set, sharing its job queue and caches (see services.py). It can also run on its
+own, e.g. against the stub pandoc of the tests:
+
+    MD2PDF_PANDOC=tests/stub_pandoc.py MD2PDF_CACHE_DIR=/tmp/md2pdf-stub python api.py --port 8502
+    curl -F files=@intro.md -F files=@body.md -F title=Report -F toc=true localhost:8502/jobs
+
+When MD2PDF_API_TOKEN is set, every request needs "Authorization: Bearer <token>".
+"""
+
+import argparse
+import hmac
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from contextlib import ExitStack
+from dataclasses import fields, replace
+from email.message import Message
+from email.parser import BytesHeaderParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import images
+import metrics
+from artifacts import ArtifactStore
+from converter import PdfOptions, convert
+from job_queue import CANCELLED, DONE, FAILED, JobQueue, QueueFull
+from render_cache import RenderCache
+from uploads import UploadLimits, UploadTooLarge, spool_uploads
+
+
+DEFAULT_PORT = 8502
+JOB_PATH_RE = re.compile(r"^/jobs/([0-9a-f]{32})(/pdf)?$")
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+# Multipart overhead (boundaries and part headers) allowed on top of the upload limit
+MULTIPART_OVERHEAD = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+# Largest non-file form field (and part header block) accepted
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class BadRequest(ValueError):
+    """Raised for a request the client has to fix; the message is sent back."""
+
+
+def parse_options(values):
+    """Build validated PdfOptions from form field strings; raises BadRequest."""
+
+    kinds = {f.name: f.type for f in fields(PdfOptions)}
+    parsed = {}
+    for name, value in values.items():
+        if name not in kinds:
+            raise BadRequest(f"Unknown field '{name}'")
+        if kinds[name] is bool:
+            if value.lower() in TRUE_VALUES:
+                value = True
+            elif value.lower() in FALSE_VALUES:
+                value = False
+            else:
+                raise BadRequest(f"Field '{name}' must be true or false")
+        parsed[name] = value
+
+    options = PdfOptions.from_dict(parsed)
+    try:
+        options.validate()
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return options
+
+
+def _boundary(content_type):
+    if not content_type.startswith("multipart/form-data"):
+        raise BadRequest("Expected a multipart/form-data upload")
+    header = Message()
+    header["Content-Type"] = content_type
+    boundary = header.get_param("boundary")
+    if not boundary:
+        raise BadRequest("Multipart upload without a boundary")
+    return boundary.encode("latin-1")
+
+
+def spool_multipart(rfile, length, content_type, dest_dir):
+    """Stream a multipart/form-data body of length bytes from rfile into dest_dir.
+
+    Returns ([(filename, path)], {field: value}). File parts are written to disk as
+    they arrive, so the request body is never held in memory; other fields are
+    capped at MAX_FIELD_BYTES.
+    """
+
+    delimiter = b"\r\n--" + _boundary(content_type)
+    remaining = length
+    # A leading CRLF lets the first delimiter match like all the others
+    buffer = b"\r\n"
+
+    def fill():
+        nonlocal buffer, remaining
+        chunk = rfile.read(min(CHUNK_SIZE, remaining)) if remaining > 0 else b""
+        if not chunk:
+            raise BadRequest("Malformed multipart body")
+        remaining -= len(chunk)
+        buffer += chunk
+
+    def read_until(marker, sink, limit=None):
+        # Copy everything before marker to sink and drop the marker from the buffer
+        nonlocal buffer
+        written = 0
+        while True:
+            index = buffer.find(marker)
+            if index >= 0:
+                data, buffer = buffer[:index], buffer[index + len(marker):]
+            else:
+                # Keep a possible partial marker for the next read
+                keep = len(marker) - 1
+                data, buffer = buffer[:len(buffer) - keep], buffer[len(buffer) - keep:]
+            written += len(data)
+            if limit is not None and written > limit:
+                raise BadRequest("Multipart field or header is too large")
+            sink.write(data)
+            if index >= 0:
+                return
+            fill()
+
+    files = []
+    values = {}
+    read_until(delimiter, io.BytesIO(), MAX_FIELD_BYTES)
+    while True:
+        while len(buffer) < 2:
+            fill()
+        if buffer.startswith(b"--"):
+            break
+        if not buffer.startswith(b"\r\n"):
+            raise BadRequest("Malformed multipart body")
+        buffer = buffer[2:]
+
+        header_bytes = io.BytesIO()
+        read_until(b"\r\n\r\n", header_bytes, MAX_FIELD_BYTES)
+        headers = BytesHeaderParser(policy=HTTP).parsebytes(header_bytes.getvalue())
+        name = headers.get_param("name", header="content-disposition")
+
+        if name == "files":
+            filename = headers.get_filename()
+            if not filename:
+                raise BadRequest("Every 'files' part needs a filename")
+            path = os.path.join(dest_dir, f"{len(files):04d}.upload")
+            with open(path, "wb") as out:
+                read_until(delimiter, out)
+            files.append((os.path.basename(filename), path))
+        else:
+            value = io.BytesIO()
+            read_until(delimiter, value, MAX_FIELD_BYTES)
+            if name:
+                values[name] = value.getvalue().decode("utf-8", "replace")
+
+    if not files:
+        raise BadRequest("Upload at least one file in a 'files' field")
+    return files, values
+
+
+def convert_uploads(uploads, options, artifact_store, image_cache=None, **convert_kwargs):
+    """Job task: spool the uploads, convert them and keep the PDF in the artifact store.
+
+    uploads are (filename, fileobj) pairs, or (filename, path) pairs for files already
+    spooled to disk. Shared by the API and the page, so both convert alike; bundles
+    are checked against the upload limits as they are unpacked.
+    """
+    with tempfile.TemporaryDirectory(prefix="md2pdf-upload-") as work_dir, ExitStack() as stack:
+        uploads = [
+            (name, stack.enter_context(open(upload, "rb")) if isinstance(upload, (str, os.PathLike)) else upload)
+            for name, upload in uploads
+        ]
+        with metrics.stage("decode"):
+            documents = spool_uploads(uploads, work_dir, limits=UploadLimits.from_env(), image_cache=image_cache)
+        result = convert(documents, options, output_path=os.path.join(work_dir, "output.pdf"), **convert_kwargs)
+        return replace(result, pdf_path=artifact_store.add(result.pdf_path))
+
+
+def job_status(job, job_queue):
+    """JSON-ready description of a job for GET /jobs/<id>."""
+
+    status = {
+        "id": job.id,
+        "status": job.status,
+        "percent": 100 if job.status == DONE else job.percent,
+        "message": job.message,
+        "position": job_queue.position(job),
+    }
+    if job.status == DONE:
+        result = job.result()
+        status.update({
+            "pdf_url": f"/jobs/{job.id}/pdf",
+            "pdf_size": result.pdf_size,
+            "from_cache": result.from_cache,
+            "warnings": result.warnings,
+        })
+    elif job.status in (FAILED, CANCELLED):
+        status.update({
+            "error": str(job.error),
+            "cause": metrics.failure_cause(job.error),
+            "details": getattr(job.error, "stderr", ""),
+        })
+    return status
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Request handler; the server carries the queue, caches and artifact store (see serve)."""
+
+    server_version = "md2pdf-api"
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_failure(self, code, message, headers=None):
+        self.send_json(code, {"error": message}, headers)
+
+    def authorized(self):
+        token = os.environ.get("MD2PDF_API_TOKEN")
+        if not token:
+            return True
+        supplied = self.headers.get("Authorization", "")
+        if hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self.send_failure(401, "Missing or wrong API token", {"WWW-Authenticate": "Bearer"})
+        return False
+
+    def find_job(self):
+        """Return (job, wants_pdf) for a /jobs/<id>[/pdf] path, or (None, False) after a 404."""
+
+        match = JOB_PATH_RE.match(self.path.split("?", 1)[0])
+        job = self.server.job_queue.get(match.group(1)) if match else None
+        if job is None:
+            self.send_failure(404, "No such job")
+            return None, False
+        return job, bool(match.group(2))
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path.split("?", 1)[0] != "/jobs":
+            self.send_failure(404, "Not found")
+            return
+
+        limits = UploadLimits.from_env()
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.send_failure(411, "Content-Length required")
+            return
+        if length > limits.max_total_bytes + MULTIPART_OVERHEAD:
+            self.send_failure(413, f"Uploads are limited to {limits.max_total_bytes // (1024 * 1024)} MB in total")
+            return
+
+        # Only paths wait in the queue. If the job never runs (cancelled, pruned), the
+        # directory is removed when the task is dropped and the object is collected.
+        spool = tempfile.TemporaryDirectory(prefix="md2pdf-api-upload-")
+        try:
+            files, values = spool_multipart(self.rfile, length, self.headers.get("Content-Type", ""), spool.name)
+            options = parse_options(values)
+            with ExitStack() as stack:
+                limits.check([(name, stack.enter_context(open(path, "rb"))) for name, path in files])
+        except BadRequest as e:
+            spool.cleanup()
+            self.send_failure(400, str(e))
+            return
+        except UploadTooLarge as e:
+            spool.cleanup()
+            self.send_failure(413, str(e))
+            return
+
+        server = self.server
+
+        def task(job):
+            try:
+                return convert_uploads(
+                    files, options, server.artifact_store, image_cache=server.image_cache,
+                    cache=server.render_cache, progress=job.report, fragment_cache=server.fragment_cache
+                )
+            finally:
+                spool.cleanup()
+
+        try:
+            job = server.job_queue.submit(task)
+        except QueueFull as e:
+            spool.cleanup()
+            self.send_failure(503, str(e), {"Retry-After": "30"})
+            return
+
+        self.send_json(202, job_status(job, server.job_queue), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        job, wants_pdf = self.find_job()
+        if job is None:
+            return
+        if not wants_pdf:
+            self.send_json(200, job_status(job, self.server.job_queue))
+            return
+
+        if job.status != DONE:
+            self.send_failure(409, f"The job is {job.status}; no PDF is available")
+            return
+        path = self.server.artifact_store.path(job.result().pdf_path.name)
+        if path is None:
+            self.send_failure(410, "The PDF has expired; submit the job again")
+            return
+
+        try:
+            pdf_file = open(path, "rb")
+        except FileNotFoundError:
+            self.send_failure(410, "The PDF has expired; submit the job again")
+            return
+        with pdf_file:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(os.fstat(pdf_file.fileno()).st_size))
+            self.send_header("Content-Disposition", f'attachment; filename="{job.id}.pdf"')
+            self.end_headers()
+            # Streamed from disk in chunks; the PDF is never held in memory
+            shutil.copyfileobj(pdf_file, self.wfile, CHUNK_SIZE)
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        job, wants_pdf = self.find_job()
+        if job is None:
+            return
+        if wants_pdf:
+            self.send_failure(405, "Cancel the job at /jobs/<id>")
+            return
+        self.server.job_queue.cancel(job)
+        self.send_json(200, job_status(job, self.server.job_queue))
+
+    def log_message(self, format, *args):
+        metrics.logger.debug(json.dumps({"event": "api_request", "client": self.client_address[0], "request": format % args}))
+
+
+def serve(port, host="0.0.0.0", job_queue=None, artifact_store=None, render_cache=None,
+          fragment_cache=None, image_cache=None):
+    """Serve the API on a daemon thread and return the server.
+
+    Pass the queue, store and caches of the Streamlit app to share them; missing
+    ones are created.
+    """
+
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.job_queue = job_queue if job_queue is not None else JobQueue()
+    server.artifact_store = artifact_store if artifact_store is not None else ArtifactStore()
+    server.render_cache = render_cache
+    server.fragment_cache = fragment_cache
+    server.image_cache = image_cache
+    thread = threading.Thread(target=server.serve_forever, name="md2pdf-api", daemon=True)
+    thread.start()
+    return server
+
+
+def serve_from_env(**shared):
+    """Start the API if MD2PDF_API_PORT is set; returns the server or None."""
+
+    port = os.environ.get("MD2PDF_API_PORT")
+    if not port:
+        return None
+    return serve(int(port), os.environ.get("MD2PDF_API_HOST", "0.0.0.0"), **shared)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the MD2PDF HTTP API on its own.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MD2PDF_API_PORT", DEFAULT_PORT)))
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk render caches")
+    args = parser.parse_args(argv)
+
+    caches = {}
+    if not args.no_cache:
+        caches = {
+            "render_cache": RenderCache(),
+            "fragment_cache": RenderCache(kind="fragments", suffix=".tex"),
+            "image_cache": images.create_cache(),
+        }
+    server = serve(args.port, args.host, **caches)
+    print(f"MD2PDF API listening on http://{args.host}:{server.server_address[1]}/jobs", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,117 +1,203 @@
+import html
+import re
 import streamlit as st
+import streamlit.components.v1 as components
 import tempfile
-import subprocess
-from pathlib import Path
-import os
-import shutil
+import zipfile
+import api
+import services
+from converter import (
+    CODE_FONT_SIZES,
+    FONT_FAMILIES,
+    FONT_SIZES,
+    MARGINS,
+    ConversionError,
+    PdfOptions,
+    render_preview,
+)
+from fonts import get_registry
+from job_queue import QueueFull
+from processes import Cancelled, LimitExceeded
+from uploads import UploadLimits, UploadTooLarge, spool_uploads
 
 
-def create_eisvogel_template(gray_background=True, code_font_size="9pt", line_numbers=True, custom_title_page=True):
-    """Create a template using the official Eisvogel template with minimal font fixes to preserve features."""
-    
-    eisvogel_path = Path(__file__).parent / "eisvogel.latex"
-    
-    if not eisvogel_path.exists():
-        # Error if Eisvogel template not found
-        raise FileNotFoundError("Eisvogel template (eisvogel.latex) not found. Please ensure the template file is in the project directory.")
+# Shared with the HTTP API and the metrics endpoint; serve.py starts those with the process
+get_render_cache = services.render_cache
+get_fragment_cache = services.fragment_cache
+get_preview_cache = services.preview_cache
+get_image_cache = services.image_cache
+get_artifact_store = services.artifact_store
+get_job_queue = services.job_queue
+
+
+def show_download(artifact_store, name, file_name):
+    """Offer a stored PDF for download without loading it into the session."""
+    path = artifact_store.path(name)
+    if path is None:
+        st.info("⌛ The generated PDF has expired. Generate it again to download it.")
+        return
     
-    try:
-        # Read the original Eisvogel template
-        with open(eisvogel_path, 'r', encoding='utf-8') as f:
-            template = f.read()
-        
-        # MINIMAL font fixes - only disable the problematic Source font packages
-        # This preserves all Eisvogel features while fixing the Times font error
-        template = template.replace(
-            '\\usepackage[default]{sourcesanspro}', 
-            '% \\usepackage[default]{sourcesanspro} % Disabled - font not available'
-        )
-        template = template.replace(
-            '\\usepackage{sourcecodepro}', 
-            '% \\usepackage{sourcecodepro} % Disabled - font not available'
+    url = artifact_store.url(path)
+    if url and st.get_option("server.enableStaticServing"):
+        # Served straight from disk by Streamlit's static file handler
+        st.markdown(
+            f'<a href="{url}" download="{html.escape(file_name)}" target="_blank" class="download-link">📥 Download PDF</a>',
+            unsafe_allow_html=True
         )
-        template = template.replace(
-            '\\usepackage[default]{sourceserifpro}', 
-            '% \\usepackage[default]{sourceserifpro} % Disabled - font not available'
-        )
-        
-        # Add safe font fallback only where Eisvogel tries to set fonts
-        # Look for specific problematic font settings and replace them
-        if '\\setmainfont{Times}' in template:
-            template = template.replace('\\setmainfont{Times}', '\\setmainfont{Liberation Serif}')
-        if '\\setmonofont{Times}' in template:
-            template = template.replace('\\setmonofont{Times}', '\\setmonofont{Liberation Mono}')
-            
-        # Replace generic Times references with Liberation
-        template = template.replace('Times', 'Liberation Serif')
-        template = template.replace('times', 'Liberation Serif')
-        
-        # Add MD2PDF branding to Eisvogel's built-in title page
-        if custom_title_page and '\\end{titlepage}' in template:
-            # Find where Eisvogel closes the title page and add our branding
-            branding_addition = """
-        % MD2PDF Branding Footer
-        \\vfill
-        \\begin{center}
-            \\footnotesize
-            Converted with md2pdf provided by brix-ia.com community
-        \\end{center}
-"""
-            template = template.replace('\\end{titlepage}', branding_addition + '\n\\end{titlepage}')
-        
-        return template
-        
-    except Exception as e:
-        # If there's any issue reading Eisvogel, raise the error
-        raise RuntimeError(f"Failed to process Eisvogel template: {str(e)}")
+    else:
+        with open(path, "rb") as pdf_file:
+            st.download_button(
+                label="📥 Download PDF",
+                data=pdf_file,
+                file_name=file_name,
+                mime="application/pdf",
+                type="primary"
+            )
 
 
-def display_file_organizer(filenames):
-    """Display file organizer with checkboxes and move buttons"""
-    
-    # Initialize session state for file order if not exists
-    if 'file_order' not in st.session_state:
-        st.session_state.file_order = [(filename, True) for filename in filenames]
+def preview_uploads(uploads, options, cache=None, image_cache=None):
+    """Stream the selected uploads to disk and render the HTML preview."""
+    with tempfile.TemporaryDirectory(prefix="md2pdf-preview-") as work_dir:
+        documents = spool_uploads(uploads, work_dir, limits=UploadLimits.from_env(), image_cache=image_cache)
+        return render_preview(documents, options, cache=cache)
+
+
+def upload_key(upload):
+    """Stable identity of an uploaded file, so duplicate names and re-uploads stay apart."""
+    return getattr(upload, "file_id", None) or f"{upload.name}:{upload.size}"
+
+
+def natural_key(name):
+    """Sort key that puts "part 2" before "part 10"."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+# Sort choices offered by the organizer: label -> (key function, reverse)
+SORT_ORDERS = {
+    "Natural (2 before 10)": (natural_key, False),
+    "Name (A→Z)": (str.lower, False),
+    "Name (Z→A)": (str.lower, True),
+    "Upload order": (None, False),
+}
+
+
+def sync_file_order(uploaded_files):
+    """Keep st.session_state.file_order, a list of (upload key, selected), in step with the uploads.
+
+    Files keep their position and selection when others are added or removed; new
+    files are appended and selected.
+    """
+    keys = [upload_key(upload) for upload in uploaded_files]
+    current = set(keys)
+    order = [(key, selected) for key, selected in st.session_state.get('file_order', []) if key in current]
+    known = {key for key, _ in order}
+    order += [(key, True) for key in keys if key not in known]
+    st.session_state.file_order = order
+
+
+def selected_in_order(uploaded_files):
+    """Uploads that are selected for inclusion, in the organized order."""
+    uploads = {upload_key(upload): upload for upload in uploaded_files}
+    return [uploads[key] for key, selected in st.session_state.file_order if selected and key in uploads]
+
+
+def move_to_positions(order, targets):
+    """Move entries of order to new 1-based positions given as {key: position}, in one pass."""
+    moved = [entry for entry in order if entry[0] in targets]
+    order = [entry for entry in order if entry[0] not in targets]
+    for entry in sorted(moved, key=lambda entry: targets[entry[0]]):
+        order.insert(min(max(targets[entry[0]], 1), len(order) + 1) - 1, entry)
+    return order
+
+
+def _organizer_changed():
+    # A new editor key discards the table's pending edits once they are applied
+    st.session_state.organizer_version = st.session_state.get('organizer_version', 0) + 1
+
+
+def _sort_files(names):
+    key_function, reverse = SORT_ORDERS[st.session_state.organizer_sort]
+    order = st.session_state.file_order
+    if key_function is None:
+        # names is in upload order
+        position = {key: i for i, key in enumerate(names)}
+        order = sorted(order, key=lambda entry: position[entry[0]])
+    else:
+        order = sorted(order, key=lambda entry: key_function(names[entry[0]]), reverse=reverse)
+    st.session_state.file_order = order
+    _organizer_changed()
+
+
+def _select_files(mode):
+    st.session_state.file_order = [
+        (key, {"all": True, "none": False, "invert": not selected}[mode])
+        for key, selected in st.session_state.file_order
+    ]
+    _organizer_changed()
+
+
+def _apply_table_edits(editor_key):
+    edits = st.session_state[editor_key]["edited_rows"]
+    order = list(st.session_state.file_order)
+    targets = {}
+    for row, changes in edits.items():
+        key, selected = order[int(row)]
+        if "Include" in changes:
+            order[int(row)] = (key, bool(changes["Include"]))
+        if changes.get("Position"):
+            targets[key] = int(changes["Position"])
+    st.session_state.file_order = move_to_positions(order, targets) if targets else order
+    _organizer_changed()
+
+
+@st.fragment
+def display_file_organizer(uploaded_files):
+    """Display the file organizer: bulk sort and selection plus an editable order table.
+
+    Runs as a fragment, so reordering only re-executes the organizer, not the whole page.
+    """
     
-    # Update file order if new files are added or removed
-    current_files = set(filenames)
-    session_files = set([f[0] for f in st.session_state.file_order])
-    if current_files != session_files:
-        st.session_state.file_order = [(filename, True) for filename in filenames]
+    # Upload key -> file name, in upload order
+    names = {upload_key(upload): upload.name for upload in uploaded_files}
+    order = st.session_state.file_order
     
-    # Display files with drag handle, checkboxes and move buttons
-    for i, (filename, selected) in enumerate(st.session_state.file_order):
-        col1, col2, col3, col4, col5 = st.columns([0.08, 0.08, 0.08, 0.66, 0.1])
-        
-        with col1:
-            st.markdown("⋮⋮", help="Drag handle")
-        
-        with col2:
-            if st.button("↑", key=f"up_{i}", disabled=(i == 0), help="Move up"):
-                # Move up
-                st.session_state.file_order[i], st.session_state.file_order[i-1] = \
-                    st.session_state.file_order[i-1], st.session_state.file_order[i]
-                st.rerun()
-        
-        with col3:
-            if st.button("↓", key=f"down_{i}", disabled=(i == len(st.session_state.file_order) - 1), help="Move down"):
-                # Move down
-                st.session_state.file_order[i], st.session_state.file_order[i+1] = \
-                    st.session_state.file_order[i+1], st.session_state.file_order[i]
-                st.rerun()
-        
-        with col4:
-            new_selected = st.checkbox(filename, value=selected, key=f"select_{i}")
-            if new_selected != selected:
-                st.session_state.file_order[i] = (filename, new_selected)
-        
-        with col5:
-            st.markdown(f"**{i+1}**")
+    col1, col2, col3, col4, col5 = st.columns([0.36, 0.16, 0.16, 0.16, 0.16], vertical_alignment="bottom")
+    with col1:
+        st.selectbox("Sort by", list(SORT_ORDERS), key="organizer_sort")
+    with col2:
+        st.button("↕️ Sort", on_click=_sort_files, args=(names,), help="Reorder all files at once")
+    with col3:
+        st.button("☑️ All", on_click=_select_files, args=("all",), help="Include every file")
+    with col4:
+        st.button("⬜ None", on_click=_select_files, args=("none",), help="Exclude every file")
+    with col5:
+        st.button("🔁 Invert", on_click=_select_files, args=("invert",), help="Invert the selection")
     
-    # Get ordered and selected files
-    ordered_files = [filename for filename, selected in st.session_state.file_order if selected]
+    editor_key = f"organizer_{st.session_state.get('organizer_version', 0)}"
+    st.data_editor(
+        {
+            "Include": [selected for _, selected in order],
+            "Position": list(range(1, len(order) + 1)),
+            "File": [names[key] for key, _ in order],
+        },
+        key=editor_key,
+        on_change=_apply_table_edits,
+        args=(editor_key,),
+        hide_index=True,
+        use_container_width=True,
+        height=min(36 * (len(order) + 1) + 3, 600),
+        column_config={
+            "Include": st.column_config.CheckboxColumn("Include", width="small"),
+            "Position": st.column_config.NumberColumn(
+                "Position", min_value=1, max_value=len(order), step=1, width="small",
+                help="Type a new position to move the file there"
+            ),
+            "File": st.column_config.TextColumn("File", disabled=True),
+        },
+    )
     
-    return ordered_files
+    selected_count = sum(1 for _, selected in order if selected)
+    st.caption(f"✅ {selected_count} of {len(order)} files selected")
 
 
 # Streamlit App Configuration
@@ -122,6 +208,7 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+
 # Custom CSS for responsive design and improved UI
 st.markdown("""
 <style>
@@ -141,6 +228,17 @@ st.markdown("""
         width: 100%;
     }
     
+    .download-link {
+        display: block;
+        text-align: center;
+        padding: 0.5rem 1rem;
+        border-radius: 0.5rem;
+        background-color: #ff4b4b;
+        color: white !important;
+        text-decoration: none !important;
+        font-weight: 600;
+    }
+    
     .upload-section {
         background-color: #f8f9fa;
         padding: 1.5rem;
@@ -161,28 +259,23 @@ st.markdown("### 📁 Upload Markdown Files")
 
 uploaded_files = st.file_uploader(
     "Choose Markdown files",
-    type=['md'],
+    type=['md', 'zip'],
     accept_multiple_files=True,
-    help="Upload multiple .md files from AI tools (ChatGPT, Claude, Perplexity, etc.)"
+    help="Upload multiple .md files from AI tools (ChatGPT, Claude, Perplexity, etc.), or a .zip with Markdown files and the images they reference"
 )
 
 st.markdown('</div>', unsafe_allow_html=True)
 
 if uploaded_files:
     st.markdown("### 📋 File Organization")
-    st.markdown("Organize your files in the desired order. Use ↑↓ buttons to reorder and checkboxes to select files for inclusion.")
-    
-    # Get filenames
-    filenames = [file.name for file in uploaded_files]
+    st.markdown("Organize your files in the desired order. Sort them in one go, type a new position to move a file, and use the checkboxes to select files for inclusion.")
     
     # Display file organizer
-    ordered_files = display_file_organizer(filenames)
+    sync_file_order(uploaded_files)
+    display_file_organizer(uploaded_files)
+    ordered_uploads = selected_in_order(uploaded_files)
     
-    if ordered_files:
-        st.markdown("**Selected files in order:**")
-        for i, filename in enumerate(ordered_files, 1):
-            st.markdown(f"{i}. {filename}")
-        
+    if ordered_uploads:
         # PDF generation options
         st.markdown("### PDF Options")
         
@@ -209,14 +302,14 @@ if uploaded_files:
         with col1:
             font_family = st.selectbox(
                 "Font Family", 
-                ["Auto-detect", "Liberation Serif", "DejaVu Serif", "Latin Modern", "Default"],
+                get_registry().choices(FONT_FAMILIES),
                 index=0,
                 help="Auto-detect finds available system fonts. Liberation/DejaVu are most compatible. Avoid Times font."
             )
-            font_size = st.selectbox("Font Size", ["10pt", "11pt", "12pt", "14pt"], index=2)
+            font_size = st.selectbox("Font Size", FONT_SIZES, index=2)
         
         with col2:
-            margin = st.selectbox("Margins", ["1.5cm", "2cm", "2.5cm", "3cm"], index=2)
+            margin = st.selectbox("Margins", MARGINS, index=2)
         
         # Code formatting options
         st.markdown("#### Code Block Options")
@@ -227,7 +320,7 @@ if uploaded_files:
             gray_code_background = st.checkbox("Gray Code Background", value=True)
         
         with col2:
-            code_font_size = st.selectbox("Code Font Size", ["8pt", "9pt", "10pt", "11pt"], index=1)
+            code_font_size = st.selectbox("Code Font Size", CODE_FONT_SIZES, index=1)
             
         # Page options
         st.markdown("#### Page Options")
@@ -238,205 +331,164 @@ if uploaded_files:
         
         with col2:
             include_toc = st.checkbox("Table of Contents", value=False)
+            parallel_chapters = st.checkbox(
+                "Parallel Chapters",
+                value=False,
+                disabled=len(ordered_uploads) < 2,
+                help="For large compilations: each file is typeset as its own chapter, in parallel, then stitched together. Every file starts on a new page and links inside files are not kept."
+            )
+            auto_fix = st.checkbox(
+                "Auto-fix Problems",
+                value=False,
+                help="Remove control characters, wrap over-long code lines and print preamble-only LaTeX commands as text instead of rejecting the document."
+            )
+        
+        # Read the order again: the organizer fragment may have changed it since this run started
+        selected_uploads = [(upload.name, upload) for upload in selected_in_order(uploaded_files)]
+        
+        options = PdfOptions(
+            title=pdf_title,
+            author=pdf_author,
+            date=pdf_date.strftime('%B %d, %Y'),
+            font_family=font_family,
+            font_size=font_size,
+            margin=margin,
+            line_numbers=include_line_numbers,
+            gray_code_background=gray_code_background,
+            code_font_size=code_font_size,
+            title_page=include_title_page,
+            toc=include_toc,
+            parallel_chapters=parallel_chapters,
+            auto_fix=auto_fix
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            preview_clicked = st.button(
+                "👁️ Quick Preview",
+                help="Instant HTML preview of the merged document. Use it to check order and content before rendering the PDF."
+            )
+        with col2:
+            generate_clicked = st.button("🚀 Generate PDF", type="primary")
+        
+        # Quick preview: one pandoc run to HTML, no LaTeX
+        if preview_clicked:
+            try:
+                UploadLimits.from_env().check(selected_uploads)
+                preview = preview_uploads(
+                    selected_uploads, options, cache=get_preview_cache(), image_cache=get_image_cache()
+                )
+                st.caption("👁️ Preview of the merged document. Fonts, page breaks and the title page are only applied in the PDF.")
+                components.html(preview, height=800, scrolling=True)
+            except UploadTooLarge as e:
+                st.error(f"📦 {e}")
+            except QueueFull as e:
+                st.warning(f"🚦 {e}")
+            except LimitExceeded as e:
+                st.error(f"⏱️ {e} and was stopped.")
+            except zipfile.BadZipFile as e:
+                st.error(f"📦 A bundle is not a valid zip file: {e}")
+            except ValueError as e:
+                # e.g. a bundle without Markdown files
+                st.error(f"📦 {e}")
+            except ConversionError as e:
+                st.error(f"❌ {e}:")
+                if e.stderr:
+                    st.code(e.stderr)
         
         # Generate PDF button
-        if st.button("🚀 Generate PDF", type="primary"):
+        if generate_clicked:
             try:
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    # Show progress
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Step 1: Save uploaded files and merge
-                    status_text.text("📝 Processing Markdown files...")
-                    progress_bar.progress(25)
-                    
-                    merged_content = []
-                    
-                    # Create a dictionary for quick lookup
-                    file_dict = {file.name: file for file in uploaded_files}
-                    
-                    for filename in ordered_files:
-                        if filename in file_dict:
-                            file_content = file_dict[filename].read().decode('utf-8')
-                            
-                            # Add file separator if multiple files
-                            if len(ordered_files) > 1:
-                                merged_content.append(f"# {filename.rsplit('.', 1)[0]}\n\n")
-                            
-                            merged_content.append(file_content)
-                            merged_content.append("\n\n")
-                    
-                    # Save merged content
-                    merged_md_path = Path(temp_dir) / "merged.md"
-                    with open(merged_md_path, "w", encoding="utf-8") as f:
-                        f.write("".join(merged_content))
-                    
-                    # Step 2: Prepare LaTeX template and background
-                    status_text.text("🎨 Preparing professional template...")
-                    progress_bar.progress(50)
-                    
-                    pdf_path = Path(temp_dir) / "output.pdf"
-                    
-                    # Create Eisvogel LaTeX template
-                    template_path = Path(temp_dir) / "template.tex"
-                    latex_template = create_eisvogel_template(gray_code_background, code_font_size, include_line_numbers, include_title_page)
-                    
-                    # Replace background path placeholder with actual path (only if title page is enabled)
-                    if include_title_page:
-                        # Use background PNG directly
-                        background_src = Path("background5.png")
-                        background_dest = Path(temp_dir) / "background.png"
-                        
-                        if background_src.exists():
-                            shutil.copy2(background_src, background_dest)
-                            latex_template = latex_template.replace("background_path_placeholder", str(background_dest))
-                        else:
-                            # Remove background inclusion if file doesn't exist
-                            latex_template = latex_template.replace(
-                                "\\AddToShipoutPictureBG*{%\n        \\includegraphics[width=\\paperwidth,height=\\paperheight]{background_path_placeholder}\n    }",
-                                ""
-                            )
-                    
-                    with open(template_path, "w", encoding="utf-8") as f:
-                        f.write(latex_template)
-                    
-                    # Build pandoc command
-                    pandoc_cmd = [
-                        "pandoc",
-                        str(merged_md_path),
-                        "-o", str(pdf_path),
-                        "--pdf-engine=xelatex",
-                        "--template", str(template_path),
-                        "-V", f"geometry:margin={margin}",
-                        "-V", "linkcolor=blue",
-                        "-V", "urlcolor=blue",
-                        "--no-highlight",
-                        "--standalone"
-                    ]
-                    
-                    # Note: Line numbers are handled in the LaTeX template
-                    # The include_line_numbers flag is passed to create_eisvogel_template
-                    
-                    # Add metadata
-                    if pdf_title.strip():
-                        pandoc_cmd.extend(["-M", f"title={pdf_title.strip()}"])
-                    if pdf_author.strip():
-                        pandoc_cmd.extend(["-M", f"author={pdf_author.strip()}"])
-                    pandoc_cmd.extend(["-M", f"date={pdf_date.strftime('%B %d, %Y')}"])
-                    
-                    # Enable title page when custom title page is requested
-                    if include_title_page:
-                        pandoc_cmd.extend(["-V", "titlepage=true"])
-                        # Add background image support
-                        if background_dest and background_dest.exists():
-                            pandoc_cmd.extend(["-V", f"titlepage-background={background_dest}"])
-                        # Set title page colors for better visibility
-                        pandoc_cmd.extend(["-V", "titlepage-text-color=5F5F5F"])
-                        pandoc_cmd.extend(["-V", "titlepage-rule-color=435488"])
-                        pandoc_cmd.extend(["-V", "titlepage-rule-height=4"])
-                    
-                    # Enable Eisvogel code highlighting with gray backgrounds
-                    # Enable listings package for gray code backgrounds
-                    pandoc_cmd.extend(["-V", "listings=true"])
-                    # Ensure line numbers are shown if requested
-                    if not include_line_numbers:
-                        pandoc_cmd.extend(["-V", "listings-disable-line-numbers=true"])
-                    # Set code block font size if specified
-                    if code_font_size != "9pt":  # 9pt is default
-                        font_size_map = {"8pt": "\\footnotesize", "10pt": "\\normalsize", "11pt": "\\large"}
-                        if code_font_size in font_size_map:
-                            pandoc_cmd.extend(["-V", f"code-block-font-size={font_size_map[code_font_size]}"])
-                    # Remove --no-highlight and add highlight-style for proper syntax highlighting
-                    if "--no-highlight" in pandoc_cmd:
-                        pandoc_cmd.remove("--no-highlight")
-                    # Add highlight style to activate Eisvogel's syntax highlighting with listings
-                    pandoc_cmd.extend(["--highlight-style=tango"])
-                    
-                    # Add table of contents if requested
-                    if include_toc:
-                        pandoc_cmd.extend(["--toc", "--toc-depth=3"])
-                    
-                    # Handle font selection - avoid Times font
-                    if font_family == "Auto-detect":
-                        # Use safe fonts that won't cause Times font errors
-                        try:
-                            # Check for Liberation fonts first (most reliable)
-                            result = subprocess.run(
-                                ["fc-list", ":family=Liberation Serif"], 
-                                capture_output=True, text=True
-                            )
-                            if result.returncode == 0 and result.stdout.strip():
-                                pandoc_cmd.extend(["-V", "mainfont=Liberation Serif"])
-                                pandoc_cmd.extend(["-V", "monofont=Liberation Mono"])
-                            else:
-                                # Use Latin Modern (always available with XeTeX) - safer than generic "serif"
-                                pandoc_cmd.extend(["-V", "mainfont=Latin Modern Roman"])
-                                pandoc_cmd.extend(["-V", "monofont=Latin Modern Mono"])
-                        except FileNotFoundError:
-                            # fc-list not available, use Latin Modern
-                            pandoc_cmd.extend(["-V", "mainfont=Latin Modern Roman"])
-                            pandoc_cmd.extend(["-V", "monofont=Latin Modern Mono"])
-                    
-                    elif font_family != "Default":
-                        # Use selected font
-                        font_mapping = {
-                            "Liberation Serif": ("Liberation Serif", "Liberation Mono"),
-                            "DejaVu Serif": ("DejaVu Serif", "DejaVu Sans Mono"),
-                            "Latin Modern": ("Latin Modern Roman", "Latin Modern Mono")
-                        }
-                        
-                        if font_family in font_mapping:
-                            main_font, mono_font = font_mapping[font_family]
-                            pandoc_cmd.extend(["-V", f"mainfont={main_font}"])
-                            pandoc_cmd.extend(["-V", f"monofont={mono_font}"])
-                    
-                    status_text.text("⚙️ Running Pandoc conversion...")
-                    progress_bar.progress(75)
-                    
-                    # Run pandoc
-                    result = subprocess.run(pandoc_cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        st.error("❌ Pandoc conversion failed:")
-                        st.code(result.stderr)
-                        st.info("💡 Make sure Pandoc and XeLaTeX are installed on your system")
+                # Enforce size limits before queueing any work
+                UploadLimits.from_env().check(selected_uploads)
+                
+                render_cache = get_render_cache()
+                fragment_cache = get_fragment_cache()
+                artifact_store = get_artifact_store()
+                image_cache = get_image_cache()
+                job_queue = get_job_queue()
+                
+                # A new render supersedes the one this session started before (e.g. with other options)
+                previous_job = job_queue.get(st.session_state.get('job_id', ''))
+                if previous_job is not None:
+                    job_queue.cancel(previous_job)
+                
+                job = job_queue.submit(
+                    lambda job: api.convert_uploads(
+                        selected_uploads, options, artifact_store, image_cache=image_cache,
+                        cache=render_cache, progress=job.report, fragment_cache=fragment_cache
+                    )
+                )
+                st.session_state.job_id = job.id
+                
+                # Show progress (queue position while waiting, then the conversion step)
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+                while not job.wait(timeout=0.5):
+                    position = job_queue.position(job)
+                    if position:
+                        status_text.text(f"⏳ Waiting in queue: position {position} of {job_queue.stats()['pending']}...")
                     else:
-                        # Step 3: Provide download
-                        status_text.text("✅ PDF generated successfully!")
-                        progress_bar.progress(100)
-                        
-                        # Read the generated PDF
-                        with open(pdf_path, "rb") as pdf_file:
-                            pdf_bytes = pdf_file.read()
-                        
-                        # Provide download button
-                        st.success("🎉 Your professional PDF is ready!")
-                        
-                        # Create filename
-                        if pdf_title.strip():
-                            filename = f"{pdf_title.strip().replace(' ', '_')}.pdf"
-                        else:
-                            filename = "merged_document.pdf"
-                        
-                        st.download_button(
-                            label="📥 Download PDF",
-                            data=pdf_bytes,
-                            file_name=filename,
-                            mime="application/pdf",
-                            type="primary"
-                        )
-                        
-                        # Show PDF info
-                        st.info(f"📊 PDF Size: {len(pdf_bytes):,} bytes | 📄 Professional Eisvogel Template")
-                        
-                        # Clear progress
-                        progress_bar.empty()
-                        status_text.empty()
-                        
+                        status_text.text(job.message)
+                        progress_bar.progress(job.percent)
+                
+                result = job.result()
+                
+                # Step 3: Provide download
+                status_text.text("✅ PDF generated successfully!")
+                progress_bar.progress(100)
+                
+                # Provide download button
+                st.success("🎉 Your professional PDF is ready!")
+                
+                st.session_state.last_pdf = (result.pdf_path.name, options.output_filename())
+                show_download(artifact_store, result.pdf_path.name, options.output_filename())
+                
+                # Show PDF info
+                size_info = f"📊 PDF Size: {result.pdf_size:,} bytes"
+                if result.original_size and result.original_size != result.pdf_size:
+                    saved = 100 * (1 - result.pdf_size / result.original_size)
+                    size_info += f" (optimized from {result.original_size:,} bytes, -{saved:.0f}%)"
+                st.info(f"{size_info} | 📄 Professional Eisvogel Template")
+                cache_stats = render_cache.stats()
+                st.caption(
+                    f"{'⚡ Served from render cache' if result.from_cache else '🆕 Freshly rendered'} | "
+                    f"cache hits: {cache_stats['hits']}, misses: {cache_stats['misses']}, "
+                    f"entries: {cache_stats['entries']} | "
+                    f"fragments reused: {result.fragments_reused}/{result.fragments_total}"
+                )
+                
+                if result.warnings:
+                    with st.expander(f"⚠️ {len(result.warnings)} possible problem(s) in the PDF"):
+                        st.code("\n".join(result.warnings))
+                
+                # Clear progress
+                progress_bar.empty()
+                status_text.empty()
+                
+            except UploadTooLarge as e:
+                st.error(f"📦 {e}")
+            except QueueFull as e:
+                st.warning(f"🚦 {e}")
+            except LimitExceeded as e:
+                st.error(f"⏱️ {e} and was stopped.")
+                st.info("💡 Split very large documents into smaller sets, or turn on Parallel Chapters")
+            except Cancelled:
+                st.info("🛑 This conversion was replaced by a newer one.")
+            except ConversionError as e:
+                st.error(f"❌ {e}:")
+                if e.stderr:
+                    st.code(e.stderr)
+                if e.cause == "preflight_failed":
+                    st.info("💡 Fix the lines listed above, or turn on Auto-fix Problems under Page Options")
+                else:
+                    st.info("💡 Make sure Pandoc and XeLaTeX are installed on your system")
             except Exception as e:
                 st.error(f"❌ An error occurred: {str(e)}")
                 st.info("💡 Please check that all required dependencies are installed and try again.")
+        elif 'last_pdf' in st.session_state:
+            # The stored PDF outlives reruns, so keep offering the last one
+            show_download(get_artifact_store(), *st.session_state.last_pdf)
     else:
         st.warning("⚠️ Please select at least one file to generate PDF.")
 else:
@@ -462,7 +514,7 @@ else:
     st.markdown("### 📋 How to Use")
     st.markdown("""
     1. **Upload** your `.md` files using the file uploader above
-    2. **Organize** files in your preferred order using the ↑↓ buttons
+    2. **Organize** files in your preferred order: sort them, or type a new position in the table
     3. **Customize** document settings, fonts, and formatting options
     4. **Generate** your professional PDF with one click
     """)
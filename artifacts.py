@@ -0,0 +1,141 @@
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+APP_DIR = Path(__file__).parent
+# Streamlit serves <app dir>/static/ at app/static/ when server.enableStaticServing is on
+STATIC_DIR = APP_DIR / "static"
+DEFAULT_ARTIFACT_DIR = STATIC_DIR / "artifacts"
+DEFAULT_TTL_MINUTES = 60
+DEFAULT_MAX_MB = 512
+# Seconds between sweeps of expired artifacts
+CLEANUP_INTERVAL = 60
+
+
+class ArtifactStore:
+    """Generated PDFs kept on disk for download, with a time-to-live and a total size cap.
+
+    Files are named by an unguessable token so they can be served as static files
+    without holding the bytes in server memory. Static serving does not go through
+    the store, so expired files are also swept every CLEANUP_INTERVAL seconds by a
+    background thread.
+    """
+
+    def __init__(self, root=None, ttl_seconds=None, max_bytes=None):
+        if root is None:
+            root = os.environ.get("MD2PDF_ARTIFACT_DIR") or DEFAULT_ARTIFACT_DIR
+        self.root = Path(root)
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("MD2PDF_ARTIFACT_TTL_MINUTES", DEFAULT_TTL_MINUTES)) * 60
+        self.ttl_seconds = ttl_seconds
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("MD2PDF_ARTIFACT_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._sweeper = threading.Thread(target=self._sweep, name="md2pdf-artifact-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def add(self, src_path, suffix=".pdf"):
+        """Move src_path into the store and return its new path."""
+
+        token = secrets.token_urlsafe(16)
+        path = self.root / f"{token}{suffix}"
+        with self._lock:
+            # Move via a hidden temporary name so the file appears complete or not at all
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".", suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.move(str(src_path), tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._cleanup(keep=path)
+        return path
+
+    def path(self, name):
+        """Return the path of a stored artifact by file name, or None if it expired."""
+
+        path = self.root / Path(name).name
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                return None
+        except FileNotFoundError:
+            return None
+        return path
+
+    def url(self, path):
+        """Relative URL of an artifact served by Streamlit's static file serving, or None."""
+
+        try:
+            relative = Path(path).resolve().relative_to(STATIC_DIR.resolve())
+        except ValueError:
+            # Stored outside static/, so it cannot be linked directly
+            return None
+        return f"app/static/{relative.as_posix()}"
+
+    def cleanup(self):
+        with self._lock:
+            self._cleanup()
+
+    def _sweep(self):
+        interval = min(CLEANUP_INTERVAL, max(1, self.ttl_seconds / 4))
+        while True:
+            time.sleep(interval)
+            try:
+                self.cleanup()
+            except OSError:
+                # e.g. the directory was removed; try again on the next sweep
+                pass
+
+    def _cleanup(self, keep=None):
+        now = time.time()
+        entries = []
+        total = 0
+        for entry in self.root.iterdir():
+            if entry.name.startswith("."):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove(entry)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total += stat.st_size
+
+        # Oldest first; the artifact just added is never evicted
+        entries.sort(key=lambda item: item[0])
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            self._remove(entry)
+            total -= size
+
+    def _remove(self, entry):
+        try:
+            entry.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            entries = [entry for entry in self.root.iterdir() if not entry.name.startswith(".")]
+            size = 0
+            for entry in entries:
+                try:
+                    size += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+            return {"entries": len(entries), "bytes": size, "max_bytes": self.max_bytes}
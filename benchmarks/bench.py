@@ -0,0 +1,348 @@
+"""Reproducible conversion benchmarks for MD2PDF.
+
+Generates synthetic Markdown corpora and times every stage of the conversion
+pipeline in converter.py across a matrix of PDF options:
+
+    ingest        streaming the uploads to disk (uploads.spool_uploads)
+    fragments     Markdown -> LaTeX body fragments (uncached)
+    template      template preparation and pandoc command building
+    pandoc_latex  pandoc rendering the standalone .tex through the Eisvogel template
+    xelatex_N     each xelatex pass (reruns until references settle, max 3)
+
+Results are written as JSON (wall time per stage, peak RSS of the child
+processes, PDF size and page count). Pass a previous result file with
+--baseline to fail on regressions:
+
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --corpus code-heavy --matrix full --repeat 3
+    python benchmarks/bench.py --baseline bench.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from converter import (  # noqa: E402
+    APP_DIR,
+    FONT_FAMILIES,
+    PdfOptions,
+    build_pandoc_cmd,
+    convert_fragments,
+    markdown_sources,
+    prepare_template,
+    run_xelatex,
+    write_body,
+)
+from fonts import get_registry  # noqa: E402
+from processes import run  # noqa: E402
+from uploads import spool_uploads  # noqa: E402
+
+
+WORDS = (
+    "markdown document converter latex template pandoc render section table figure code "
+    "listing performance cache memory page font title content report analysis result"
+).split()
+
+
+# Corpus generation
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng, sentences=5):
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def _code_block(rng, lines):
+    body = []
+    for i in range(lines):
+        name = rng.choice(WORDS)
+        body.append(f"    {name}_{i} = compute('{name}', {i}) + {rng.randint(0, 999)}  # {_sentence(rng, 4)}")
+    return "```python\ndef generated():\n" + "\n".join(body) + "\n    return None\n```"
+
+
+def _table(rng, columns, rows):
+    header = "| " + " | ".join(f"Col {c}" for c in range(columns)) + " |"
+    rule = "|" + "|".join("---" for _ in range(columns)) + "|"
+    body = [
+        "| " + " | ".join(rng.choice(WORDS) for _ in range(columns)) + " |"
+        for _ in range(rows)
+    ]
+    return "\n".join([header, rule] + body)
+
+
+def _headings(rng, depth, breadth, level=2):
+    if level > depth:
+        return []
+    parts = []
+    for i in range(breadth):
+        parts.append(f"{'#' * level} {_sentence(rng, 3)[:-1]} {level}.{i}")
+        parts.append(_paragraph(rng, 2))
+        parts.extend(_headings(rng, depth, max(1, breadth - 1), level + 1))
+    return parts
+
+
+def _document(rng, profile, image_path):
+    parts = [_paragraph(rng)]
+    for section in range(profile.get("sections", 3)):
+        parts.append(f"## Section {section}")
+        parts.append(_paragraph(rng, profile.get("paragraph_sentences", 5)))
+        for _ in range(profile.get("code_blocks", 0)):
+            parts.append(_code_block(rng, profile.get("code_lines", 20)))
+        for _ in range(profile.get("tables", 0)):
+            parts.append(_table(rng, profile.get("table_columns", 4), profile.get("table_rows", 10)))
+        for _ in range(profile.get("images", 0)):
+            parts.append(f"![{_sentence(rng, 4)}]({image_path})")
+    if profile.get("heading_depth"):
+        parts.extend(_headings(rng, profile["heading_depth"], profile.get("heading_breadth", 3)))
+    return "\n\n".join(parts) + "\n"
+
+
+CORPORA = {
+    "small": {"files": 3, "sections": 3},
+    "many-files": {"files": 60, "sections": 2, "paragraph_sentences": 3},
+    "code-heavy": {"files": 8, "sections": 3, "code_blocks": 3, "code_lines": 120},
+    "wide-tables": {"files": 5, "sections": 3, "tables": 2, "table_columns": 12, "table_rows": 60},
+    "deep-headings": {"files": 6, "sections": 1, "heading_depth": 5, "heading_breadth": 3, "toc": True},
+    "images": {"files": 5, "sections": 4, "images": 2},
+}
+
+
+def generate_corpus(name, target_dir, seed=0):
+    """Write a synthetic corpus and return its (filename, path) documents in order."""
+
+    profile = CORPORA[name]
+    rng = random.Random(f"{name}:{seed}")
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    image_path = target_dir / "figure.png"
+    shutil.copy2(APP_DIR / "background5.png", image_path)
+
+    documents = []
+    for i in range(profile["files"]):
+        path = target_dir / f"{i + 1:03d}-{name}.md"
+        path.write_text(f"Generated file {i + 1} of the {name} corpus.\n\n" + _document(rng, profile, image_path),
+                        encoding="utf-8")
+        documents.append((path.name, path))
+    return documents
+
+
+# Option matrix
+
+def option_matrix(kind, corpus_profile):
+    """Return (label, PdfOptions) pairs to run for one corpus."""
+
+    toc = corpus_profile.get("toc", False)
+    base = {"title": "Benchmark", "author": "md2pdf", "date": "January 01, 2025", "toc": toc}
+    if kind == "default":
+        return [("default", PdfOptions(**base))]
+
+    if kind == "quick":
+        return [
+            ("default", PdfOptions(**base)),
+            ("no-title-page", PdfOptions(**base, title_page=False)),
+            ("code-8pt", PdfOptions(**base, code_font_size="8pt")),
+            ("toc", PdfOptions(**{**base, "toc": True})),
+        ]
+
+    fonts = [choice for choice in get_registry().choices(FONT_FAMILIES) if choice != "Default"]
+    variants = []
+    for font, code_size, title_page, with_toc in product(fonts, ["8pt", "11pt"], [True, False], [False, True]):
+        label = f"{font}|code-{code_size}|{'title' if title_page else 'no-title'}|{'toc' if with_toc else 'no-toc'}"
+        options = {**base, "font_family": font, "code_font_size": code_size,
+                   "title_page": title_page, "toc": with_toc}
+        variants.append((label, PdfOptions(**options)))
+    return variants
+
+
+# Measurement
+
+def _max_rss_kb(result):
+    return result.rusage.ru_maxrss if result.rusage is not None else 0
+
+
+def _count_pages(pdf_bytes):
+    return len(re.findall(rb"/Type\s*/Page(?!s)", pdf_bytes))
+
+
+def benchmark_once(documents, options):
+    """Run the pipeline stage by stage and return a result record."""
+
+    stages = {}
+    peak_rss = 0
+    with tempfile.TemporaryDirectory(prefix="md2pdf-bench-") as work_dir:
+        work_dir = Path(work_dir)
+
+        started = time.perf_counter()
+        opened = [(name, open(path, "rb")) for name, path in documents]
+        try:
+            spooled = spool_uploads(opened, work_dir)
+        finally:
+            for _, fileobj in opened:
+                fileobj.close()
+        stages["ingest"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        fragments, _ = convert_fragments(markdown_sources(spooled), cache=None, work_dir=work_dir)
+        body_path = work_dir / "body.tex"
+        write_body(fragments, body_path)
+        stages["fragments"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        empty_md_path = work_dir / "document.md"
+        empty_md_path.write_text("", encoding="utf-8")
+        tex_path = work_dir / "output.tex"
+        _, template_path, background_path = prepare_template(work_dir, options)
+        pandoc_cmd = build_pandoc_cmd(
+            empty_md_path, tex_path, template_path, background_path, options, body_path=body_path
+        )
+        # Stop at the .tex file so the xelatex passes can be timed one by one
+        pandoc_cmd = [arg for arg in pandoc_cmd if not arg.startswith("--pdf-engine")]
+        stages["template"] = time.perf_counter() - started
+
+        result = run(pandoc_cmd, cwd=work_dir)
+        stages["pandoc_latex"] = result.elapsed
+        peak_rss = max(peak_rss, _max_rss_kb(result))
+        if result.returncode != 0:
+            raise RuntimeError(f"pandoc failed: {result.stderr[-2000:]}")
+
+        # pandoc always runs a second pass for the table of contents
+        passes = run_xelatex(tex_path, min_passes=2 if options.toc else 1)
+        for number, result in enumerate(passes, 1):
+            stages[f"xelatex_{number}"] = result.elapsed
+            peak_rss = max(peak_rss, _max_rss_kb(result))
+
+        pdf_bytes = (work_dir / "output.pdf").read_bytes()
+
+    return {
+        "stages": stages,
+        "total": sum(stages.values()),
+        "xelatex_passes": len(passes),
+        "peak_rss_kb": peak_rss,
+        "pdf_bytes": len(pdf_bytes),
+        "pages": _count_pages(pdf_bytes),
+    }
+
+
+def _median_record(records):
+    stage_names = {name for record in records for name in record["stages"]}
+    return {
+        "stages": {
+            name: round(statistics.median(r["stages"].get(name, 0.0) for r in records), 4)
+            for name in sorted(stage_names)
+        },
+        "total": round(statistics.median(r["total"] for r in records), 4),
+        "xelatex_passes": max(r["xelatex_passes"] for r in records),
+        "peak_rss_kb": max(r["peak_rss_kb"] for r in records),
+        "pdf_bytes": records[-1]["pdf_bytes"],
+        "pages": records[-1]["pages"],
+    }
+
+
+def _tool_version(cmd):
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    lines = result.stdout.splitlines()
+    return lines[0] if lines else None
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of total time against a baseline result file."""
+
+    previous = {(r["corpus"], r["variant"]): r for r in baseline["results"] if r.get("ok")}
+    regressions = []
+    for record in results:
+        before = previous.get((record["corpus"], record["variant"]))
+        if not record.get("ok") or before is None:
+            continue
+        if record["total"] > before["total"] * (1 + tolerance):
+            regressions.append(
+                f"{record['corpus']} [{record['variant']}]: {before['total']:.2f}s -> {record['total']:.2f}s"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MD2PDF conversion pipeline.")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA),
+                        help="Corpus to run (repeatable; default: all)")
+    parser.add_argument("--matrix", choices=["default", "quick", "full"], default="quick",
+                        help="Option matrix to run per corpus (default: quick)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per combination; medians are reported")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus generation seed")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--baseline", help="Previous JSON results to compare total times against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown against the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="md2pdf-corpus-") as corpus_root:
+        for corpus in args.corpus or sorted(CORPORA):
+            documents = generate_corpus(corpus, Path(corpus_root) / corpus, seed=args.seed)
+            for variant, options in option_matrix(args.matrix, CORPORA[corpus]):
+                record = {"corpus": corpus, "variant": variant, "files": len(documents), "ok": True}
+                try:
+                    record.update(_median_record([
+                        benchmark_once(documents, options) for _ in range(max(1, args.repeat))
+                    ]))
+                except Exception as e:
+                    # ConversionError keeps the xelatex/pandoc log tail in stderr
+                    detail = getattr(e, "stderr", "")
+                    record.update({"ok": False, "error": f"{e}: {detail[-2000:]}" if detail else str(e)})
+                results.append(record)
+                status = f"{record['total']:.2f}s" if record["ok"] else f"FAILED: {record['error'][:200]}"
+                print(f"{corpus:>14} [{variant}] {status}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandoc": _tool_version(["pandoc", "--version"]),
+            "xelatex": _tool_version(["xelatex", "--version"]),
+            "matrix": args.matrix,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    exit_code = 0 if all(record["ok"] for record in results) else 1
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
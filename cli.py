@@ -0,0 +1,224 @@
+"""Batch command-line entry point for MD2PDF.
+
+Renders many Markdown sets in parallel using the same conversion engine and
+option mapping as the Streamlit UI:
+
+    python cli.py reports/ -o out/ --jobs 4 --toc
+    python cli.py manifest.json -o out/
+
+A directory input renders every subdirectory containing .md files as one
+merged document (files in name order) and every loose .md file or .zip bundle on
+its own.
+
+A manifest is a JSON file of the form:
+
+    {
+        "defaults": {"author": "Team", "toc": true},
+        "documents": [
+            {"output": "q1.pdf", "files": ["q1/intro.md", "q1/body.md"], "options": {"title": "Q1"}}
+        ]
+    }
+
+Relative paths are resolved against the manifest's directory. Option keys match
+the PdfOptions fields in converter.py.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from pathlib import Path
+
+import images
+import metrics
+from converter import (
+    CODE_FONT_SIZES,
+    FONT_FAMILIES,
+    FONT_SIZES,
+    MARGINS,
+    ConversionError,
+    PdfOptions,
+    convert,
+)
+from render_cache import RenderCache
+from uploads import spool_uploads
+
+
+def discover_directory(input_dir):
+    """Turn a directory into a list of (name, [md paths]) sets."""
+
+    input_dir = Path(input_dir)
+    sets = []
+    for entry in sorted(input_dir.iterdir()):
+        if entry.is_dir():
+            md_files = sorted(entry.glob("*.md"))
+            if md_files:
+                sets.append((entry.name, md_files))
+        elif entry.suffix.lower() in (".md", ".zip"):
+            # A zip bundle holds Markdown files and the images they reference
+            sets.append((entry.stem, [entry]))
+    return sets
+
+
+def load_manifest(manifest_path):
+    """Read a JSON manifest into (output name, [md paths], option overrides) entries."""
+
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    base_dir = manifest_path.parent
+    defaults = manifest.get("defaults", {})
+    entries = []
+    for i, document in enumerate(manifest.get("documents", []), 1):
+        files = [base_dir / name for name in document.get("files", [])]
+        if not files:
+            raise ValueError(f"Manifest document #{i} has no files")
+        output = document.get("output") or f"{files[0].stem}.pdf"
+        entries.append((output, files, {**defaults, **document.get("options", {})}))
+    return entries
+
+
+def render_set(output_path, md_paths, option_values, use_cache):
+    """Worker entry point: render one set and write it to output_path."""
+
+    started = time.perf_counter()
+    with metrics.trace() as trace:
+        outcome = _render_set(output_path, md_paths, option_values, use_cache)
+    outcome["seconds"] = round(time.perf_counter() - started, 3)
+    outcome["stages"] = {record["stage"]: record["seconds"] for record in trace["stages"]}
+    return outcome
+
+
+def _render_set(output_path, md_paths, option_values, use_cache):
+    try:
+        options = PdfOptions.from_dict(option_values)
+        options.validate()
+        cache = RenderCache() if use_cache else None
+        fragment_cache = RenderCache(kind="fragments", suffix=".tex") if use_cache else None
+        image_cache = images.create_cache() if use_cache else None
+        with tempfile.TemporaryDirectory(prefix="md2pdf-batch-") as work_dir, ExitStack() as stack:
+            files = [(path.name, stack.enter_context(open(path, "rb"))) for path in md_paths]
+            # Normalises encodings to UTF-8 without loading whole files into memory
+            with metrics.stage("decode"):
+                documents = spool_uploads(files, work_dir, image_cache=image_cache)
+            result = convert(documents, options, cache=cache, fragment_cache=fragment_cache)
+
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_bytes(result.pdf_bytes)
+
+        return {
+            "output": str(output_path),
+            "ok": True,
+            "bytes": len(result.pdf_bytes),
+            "from_cache": result.from_cache,
+            "warnings": result.warnings,
+        }
+    except ConversionError as e:
+        error = f"{e}\n{e.stderr}".strip()
+    except Exception as e:
+        error = str(e)
+
+    return {
+        "output": str(output_path),
+        "ok": False,
+        "error": error,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch-convert Markdown sets to PDF with the Eisvogel template.")
+    parser.add_argument("input", help="Directory of Markdown sets or a JSON manifest")
+    parser.add_argument("-o", "--output-dir", default="pdf-output", help="Where to write the PDFs (default: pdf-output)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk render cache")
+
+    defaults = PdfOptions()
+    options = parser.add_argument_group("PDF options (defaults for every set)")
+    options.add_argument("--title", help="Document title (default: set name)")
+    options.add_argument("--author", default=defaults.author)
+    options.add_argument("--date", help="Date shown on the title page (default: today)")
+    options.add_argument("--font-family", choices=FONT_FAMILIES, default=defaults.font_family)
+    options.add_argument("--font-size", choices=FONT_SIZES, default=defaults.font_size)
+    options.add_argument("--margin", choices=MARGINS, default=defaults.margin)
+    options.add_argument("--code-font-size", choices=CODE_FONT_SIZES, default=defaults.code_font_size)
+    options.add_argument("--no-line-numbers", action="store_true")
+    options.add_argument("--no-gray-code-background", action="store_true")
+    options.add_argument("--no-title-page", action="store_true")
+    options.add_argument("--toc", action="store_true")
+    options.add_argument("--parallel-chapters", action="store_true",
+                         help="Typeset each file as a chapter in parallel and stitch them (see MD2PDF_RENDER_WORKERS)")
+    options.add_argument("--auto-fix", action="store_true",
+                         help="Fix problems found by the preflight checks instead of failing the set")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    base_options = {
+        "author": args.author,
+        "font_family": args.font_family,
+        "font_size": args.font_size,
+        "margin": args.margin,
+        "code_font_size": args.code_font_size,
+        "line_numbers": not args.no_line_numbers,
+        "gray_code_background": not args.no_gray_code_background,
+        "title_page": not args.no_title_page,
+        "toc": args.toc,
+        "parallel_chapters": args.parallel_chapters,
+        "auto_fix": args.auto_fix,
+    }
+    base_options["date"] = args.date or PdfOptions().date
+
+    input_path = Path(args.input)
+    output_dir = Path(args.output_dir)
+    jobs = []
+    if input_path.is_dir():
+        for name, md_paths in discover_directory(input_path):
+            option_values = {**base_options, "title": args.title or name}
+            jobs.append((output_dir / f"{name}.pdf", md_paths, option_values))
+    elif input_path.is_file():
+        for output, md_paths, overrides in load_manifest(input_path):
+            option_values = {**base_options, "title": args.title or Path(output).stem, **overrides}
+            jobs.append((output_dir / output, md_paths, option_values))
+    else:
+        print(f"Input not found: {input_path}", file=sys.stderr)
+        return 2
+
+    if not jobs:
+        print(f"No Markdown sets found in {input_path}", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [
+            pool.submit(render_set, output_path, md_paths, option_values, not args.no_cache)
+            for output_path, md_paths, option_values in jobs
+        ]
+        for future in as_completed(futures):
+            outcome = future.result()
+            if outcome["ok"]:
+                source = "cache" if outcome["from_cache"] else "rendered"
+                stages = ", ".join(f"{name} {seconds}s" for name, seconds in outcome["stages"].items())
+                print(f"✅ {outcome['output']} ({outcome['bytes']:,} bytes, {source}, {outcome['seconds']}s: {stages})")
+                for warning in outcome["warnings"]:
+                    print(f"   ⚠️ {warning}", file=sys.stderr)
+            else:
+                failures += 1
+                print(f"❌ {outcome['output']}: {outcome['error']}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"{len(jobs) - failures}/{len(jobs)} documents in {elapsed:.1f}s using {args.jobs} worker(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1074 @@
+import functools
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote
+
+import fonts
+import images
+import latex_format
+import metrics
+import postprocess
+import preflight
+import processes
+from job_queue import QueueFull
+from render_cache import render_key
+from uploads import INLINE_IMAGE_RE
+
+
+APP_DIR = Path(__file__).parent
+EISVOGEL_PATH = APP_DIR / "eisvogel.latex"
+BACKGROUND_PATH = APP_DIR / "background5.png"
+TEMPLATE_DIR = Path(tempfile.gettempdir()) / "md2pdf-cache" / "templates"
+
+# Choices offered by the UI; the CLI validates against the same lists
+FONT_FAMILIES = ["Auto-detect", "Liberation Serif", "DejaVu Serif", "Latin Modern", "Default"]
+FONT_SIZES = ["10pt", "11pt", "12pt", "14pt"]
+MARGINS = ["1.5cm", "2cm", "2.5cm", "3cm"]
+CODE_FONT_SIZES = ["8pt", "9pt", "10pt", "11pt"]
+
+# Pandoc executable; point MD2PDF_PANDOC at a stub to exercise the pipeline without TeX
+PANDOC = os.environ.get("MD2PDF_PANDOC", "pandoc")
+
+HIGHLIGHT_STYLE = "tango"
+CHUNK_SIZE = 64 * 1024
+
+# Arguments for converting one Markdown source into a LaTeX body fragment
+FRAGMENT_ARGS = ["-f", "markdown", "-t", "latex", f"--highlight-style={HIGHLIGHT_STYLE}"]
+# Raw LaTeX line used to split a batch conversion back into per-source fragments
+FRAGMENT_BREAK = "%%MD2PDF-FRAGMENT-BREAK%%"
+
+# Image references (![alt][label], ![label]) and reference definitions ([label]: target)
+IMAGE_REFERENCE_RE = re.compile(r"!\[([^\]]*)\](?:\[([^\]]*)\])?")
+REFERENCE_DEFINITION_RE = re.compile(r"^\s{0,3}\[([^\]]+)\]:\s*(<[^>]*>|\S+)")
+
+# Arguments for the quick HTML preview of the merged document (no template, no xelatex)
+PREVIEW_ARGS = ["-f", "markdown", "-t", "html5", "--standalone", "--mathml", f"--highlight-style={HIGHLIGHT_STYLE}"]
+# Previews run outside the job queue, so they are bounded separately
+PREVIEW_WORKERS = max(1, int(os.environ.get("MD2PDF_PREVIEW_WORKERS", 2)))
+# Seconds a preview waits for a free slot before the user is told to retry
+PREVIEW_WAIT = 30
+_preview_slots = threading.BoundedSemaphore(PREVIEW_WORKERS)
+
+# The final render sees an empty Markdown document with the fragments appended as
+# raw LaTeX, so pandoc cannot detect which template features the body needs. Turn on
+# the content-dependent template sections up front instead.
+ASSEMBLY_VARIABLES = ["tables=true", "multirow=true", "graphics=true", "strikeout=true", "verbatim-in-note=true"]
+
+# Sharded rendering: chapters are typeset without headers, footers or page numbers and
+# stitched into the main document with pdfpages, which adds them back
+SHARD_VARIABLES = ["disable-header-and-footer=true", "pagestyle=empty"]
+STITCH_HEADER = "\\usepackage{pdfpages}\n"
+CHAPTER_LABEL = "md2pdf-chapter-{}"
+CHAPTER_LABEL_RE = re.compile(r"\\newlabel\{md2pdf-chapter-(\d+)\}\{\{(?:[^{}]|\{[^{}]*\})*\}\{(\d+)\}")
+# Table of contents entries a shard writes to its .aux file, with their depth in the
+# stitched document; deeper ones are left out like --toc-depth=3 does
+TOC_ENTRY_START = "\\@writefile{toc}{\\contentsline "
+TOC_LEVELS = {"part": -1, "chapter": 0, "section": 1, "subsection": 2, "subsubsection": 3}
+MAX_XELATEX_PASSES = 3
+
+
+def _today():
+    return datetime.now().date().strftime('%B %d, %Y')
+
+
+@dataclass(frozen=True)
+class PdfOptions:
+    """All user-facing options that influence a render."""
+
+    title: str = "Merged Markdown Document"
+    author: str = ""
+    date: str = field(default_factory=_today)
+    font_family: str = "Auto-detect"
+    font_size: str = "12pt"
+    margin: str = "2.5cm"
+    line_numbers: bool = True
+    gray_code_background: bool = True
+    code_font_size: str = "9pt"
+    title_page: bool = True
+    toc: bool = False
+    # Render files as separate chapters in parallel and stitch them (see render_workers)
+    parallel_chapters: bool = False
+    # Fix what preflight can fix safely instead of rejecting the document (see check_sources)
+    auto_fix: bool = False
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build options from a plain dict, ignoring unknown keys."""
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def validate(self):
+        """Raise ValueError if a choice is not one the UI offers."""
+        for value, choices, label in [
+            (self.font_family, FONT_FAMILIES, "font family"),
+            (self.font_size, FONT_SIZES, "font size"),
+            (self.margin, MARGINS, "margin"),
+            (self.code_font_size, CODE_FONT_SIZES, "code font size"),
+        ]:
+            if value not in choices:
+                raise ValueError(f"Unsupported {label} '{value}'. Choose one of: {', '.join(choices)}")
+
+    def output_filename(self):
+        """Download filename derived from the title."""
+        if self.title.strip():
+            return f"{self.title.strip().replace(' ', '_')}.pdf"
+        return "merged_document.pdf"
+
+
+class ConversionError(RuntimeError):
+    """Raised when pandoc/xelatex fails; keeps the tool's stderr for display.
+
+    cause is a short label for metrics and logs (e.g. "pandoc_missing").
+    """
+
+    def __init__(self, message, stderr="", cause="conversion_failed"):
+        super().__init__(message)
+        self.stderr = stderr
+        self.cause = cause
+
+
+@dataclass
+class ConversionResult:
+    """A finished render: pdf_bytes in memory, or pdf_path when convert() wrote to a file."""
+
+    pdf_bytes: bytes = None
+    from_cache: bool = False
+    fragments_total: int = 0
+    fragments_reused: int = 0
+    pdf_path: Path = None
+    pdf_size: int = 0
+    # Size before post-processing; 0 when the PDF was not post-processed in this call
+    original_size: int = 0
+    # Non-fatal preflight findings, as "file:line: message" strings
+    warnings: list = field(default_factory=list)
+
+
+@functools.lru_cache(maxsize=None)
+def _read_eisvogel():
+    eisvogel_path = EISVOGEL_PATH
+
+    if not eisvogel_path.exists():
+        # Error if Eisvogel template not found
+        raise FileNotFoundError("Eisvogel template (eisvogel.latex) not found. Please ensure the template file is in the project directory.")
+
+    # Read the original Eisvogel template
+    with open(eisvogel_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=None)
+def _process_template(custom_title_page, dump_marker):
+    try:
+        template = _read_eisvogel()
+
+        # MINIMAL font fixes - only disable the problematic Source font packages
+        # This preserves all Eisvogel features while fixing the Times font error
+        template = template.replace(
+            '\\usepackage[default]{sourcesanspro}',
+            '% \\usepackage[default]{sourcesanspro} % Disabled - font not available'
+        )
+        template = template.replace(
+            '\\usepackage{sourcecodepro}',
+            '% \\usepackage{sourcecodepro} % Disabled - font not available'
+        )
+        template = template.replace(
+            '\\usepackage[default]{sourceserifpro}',
+            '% \\usepackage[default]{sourceserifpro} % Disabled - font not available'
+        )
+
+        # Add safe font fallback only where Eisvogel tries to set fonts
+        # Look for specific problematic font settings and replace them
+        if '\\setmainfont{Times}' in template:
+            template = template.replace('\\setmainfont{Times}', '\\setmainfont{Liberation Serif}')
+        if '\\setmonofont{Times}' in template:
+            template = template.replace('\\setmonofont{Times}', '\\setmonofont{Liberation Mono}')
+
+        # Replace generic Times references with Liberation
+        template = template.replace('Times', 'Liberation Serif')
+        template = template.replace('times', 'Liberation Serif')
+
+        # Add MD2PDF branding to Eisvogel's built-in title page
+        if custom_title_page and '\\end{titlepage}' in template:
+            # Find where Eisvogel closes the title page and add our branding
+            branding_addition = """
+        % MD2PDF Branding Footer
+        \\vfill
+        \\begin{center}
+            \\footnotesize
+            Converted with md2pdf provided by brix-ia.com community
+        \\end{center}
+"""
+            template = template.replace('\\end{titlepage}', branding_addition + '\n\\end{titlepage}')
+
+        # Variant for precompiled preamble formats: everything up to the marker comes
+        # from the format (see latex_format.py)
+        if dump_marker:
+            class_line = ']{$if(book)$scrbook$else$scrartcl$endif$}\n'
+            if class_line not in template:
+                raise ValueError("document class declaration not found")
+            template = template.replace(class_line, class_line + latex_format.DUMP_MARKER + '\n', 1)
+
+        return template
+
+    except Exception as e:
+        # If there's any issue reading Eisvogel, raise the error
+        raise RuntimeError(f"Failed to process Eisvogel template: {str(e)}")
+
+
+def create_eisvogel_template(gray_background=True, code_font_size="9pt", line_numbers=True, custom_title_page=True, dump_marker=False):
+    """Create a template using the official Eisvogel template with minimal font fixes to preserve features.
+
+    Processed variants are memoized. Only the title page branding (and the optional
+    format dump marker) change the template text; the code block options reach the
+    template as pandoc variables.
+    """
+
+    return _process_template(custom_title_page, dump_marker)
+
+
+_template_files_lock = threading.Lock()
+
+
+def _template_file(custom_title_page, dump_marker):
+    template = _process_template(custom_title_page, dump_marker)
+    digest = hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+    path = TEMPLATE_DIR / f"eisvogel-{digest}.latex"
+
+    with _template_files_lock:
+        # Checked on every render so a cleaned-up temp dir is simply rewritten
+        if not path.exists():
+            TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
+            # Write atomically; other processes may be reading the same file
+            fd, tmp_path = tempfile.mkstemp(dir=TEMPLATE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(template)
+            os.replace(tmp_path, path)
+
+    return path
+
+
+def warm_templates():
+    """Process and write every template variant up front so renders never pay for it."""
+
+    variants = [(title_page, False) for title_page in (True, False)]
+    if latex_format.enabled():
+        variants += [(title_page, True) for title_page in (True, False)]
+
+    for custom_title_page, dump_marker in variants:
+        _template_file(custom_title_page, dump_marker)
+
+
+def markdown_sources(documents):
+    """Split (filename, content) pairs into the ordered Markdown sources of the merged document.
+
+    content is either the Markdown text or the Path of a UTF-8 file holding it. Mirrors
+    write_merged_markdown: a generated heading per file when there are several, then the
+    file itself. Each source becomes one independently cached LaTeX fragment.
+    """
+
+    sources = []
+    for filename, file_content in documents:
+        if len(documents) > 1:
+            sources.append(f"# {filename.rsplit('.', 1)[0]}\n")
+        sources.append(file_content)
+    return sources
+
+
+def _copy_source(source, out):
+    """Write a source (text or file path) to an open text file, streaming files in chunks."""
+
+    if isinstance(source, Path):
+        with open(source, "r", encoding="utf-8") as f:
+            shutil.copyfileobj(f, out, CHUNK_SIZE)
+    else:
+        out.write(source)
+
+
+def _source_digest(source):
+    digest = hashlib.sha256()
+    if isinstance(source, Path):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _has_foreign_images(lines):
+    labels = set()
+    definitions = {}
+    for line in lines:
+        if "![" in line:
+            for match in INLINE_IMAGE_RE.finditer(line):
+                if not images.xelatex_can_include(unquote(match.group(2).strip("<>"))):
+                    return True
+            for match in IMAGE_REFERENCE_RE.finditer(line):
+                labels.add((match.group(2) or match.group(1)).lower())
+        definition = REFERENCE_DEFINITION_RE.match(line)
+        if definition:
+            definitions[definition.group(1).lower()] = unquote(definition.group(2).strip("<>"))
+    return any(
+        not images.xelatex_can_include(definitions[label]) for label in labels if label in definitions
+    )
+
+
+def needs_pandoc_images(source):
+    """Whether a source has images xelatex cannot include (see images.xelatex_can_include).
+
+    LaTeX fragments hand image targets to xelatex unchanged, so documents with remote,
+    SVG, GIF or WebP images are rendered by pandoc from the merged Markdown instead,
+    which fetches and converts them (or falls back to the alt text with a warning).
+    """
+
+    if isinstance(source, Path):
+        with open(source, "r", encoding="utf-8") as f:
+            return _has_foreign_images(f)
+    return _has_foreign_images(io.StringIO(source))
+
+
+def fragment_key(source):
+    return render_key(_source_digest(source), FRAGMENT_ARGS, "")
+
+
+def _convert_to_latex(source):
+    if isinstance(source, Path):
+        # Let pandoc read the file itself rather than piping it through memory
+        cmd, markdown_input = [PANDOC, str(source)] + FRAGMENT_ARGS, None
+    else:
+        cmd, markdown_input = [PANDOC] + FRAGMENT_ARGS, source
+
+    try:
+        result = processes.run(cmd, input=markdown_input)
+    except FileNotFoundError:
+        raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+    if result.returncode != 0:
+        raise ConversionError("Pandoc conversion failed", result.stderr, cause="markdown_failed")
+    return result.stdout
+
+
+def _convert_batch(sources, work_dir):
+    """Convert several sources in one pandoc run; None if they could not be split apart again.
+
+    Every source is parsed on its own (--file-scope), so heading identifiers, link
+    references and footnotes do not leak between them and each fragment is exactly
+    what converting the source alone would produce. That keeps cached fragments a
+    function of their own content only.
+    """
+
+    work_dir = Path(work_dir)
+    separator_path = work_dir / "break.md"
+    separator_path.write_text(f"```{{=latex}}\n{FRAGMENT_BREAK}\n```\n", encoding="utf-8")
+
+    inputs = []
+    for index, source in enumerate(sources):
+        if index:
+            inputs.append(str(separator_path))
+        if not isinstance(source, Path):
+            source_path = work_dir / f"source-{index:04d}.md"
+            source_path.write_text(source, encoding="utf-8")
+            source = source_path
+        inputs.append(str(source))
+
+    try:
+        result = processes.run([PANDOC, "--file-scope"] + inputs + FRAGMENT_ARGS)
+    except FileNotFoundError:
+        raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+    if result.returncode != 0:
+        raise ConversionError("Pandoc conversion failed", result.stderr, cause="markdown_failed")
+
+    parts = result.stdout.split(FRAGMENT_BREAK)
+    if len(parts) != len(sources):
+        return None
+    return [part.strip("\n") + "\n" for part in parts]
+
+
+def convert_fragments(sources, cache=None, work_dir=None):
+    """Convert Markdown sources to LaTeX body fragments, only sending cache misses to pandoc.
+
+    Returns (fragments, reused) where reused counts fragments served from the cache.
+    """
+
+    fragments = [None] * len(sources)
+    missing = {}
+    for index, source in enumerate(sources):
+        key = fragment_key(source)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            fragments[index] = cached.decode("utf-8")
+        else:
+            missing.setdefault(key, []).append(index)
+
+    if missing:
+        keys = list(missing)
+        pending = [sources[missing[key][0]] for key in keys]
+
+        # One pandoc start-up for all misses, falling back to one run per source
+        converted = None
+        if len(pending) > 1:
+            with tempfile.TemporaryDirectory(dir=work_dir) as batch_dir:
+                converted = _convert_batch(pending, batch_dir)
+        if converted is None:
+            converted = [_convert_to_latex(source) for source in pending]
+
+        for key, fragment in zip(keys, converted):
+            for index in missing[key]:
+                fragments[index] = fragment
+            if cache is not None:
+                cache.put(key, fragment.encode("utf-8"))
+
+    reused = len(sources) - sum(len(indices) for indices in missing.values())
+    return fragments, reused
+
+
+def write_body(fragments, body_path):
+    """Write fragments in document order to body_path and return a digest of the body."""
+
+    digest = hashlib.sha256()
+    with open(body_path, "w", encoding="utf-8") as out:
+        for index, fragment in enumerate(fragments):
+            # Separate fragments like merged Markdown paragraphs
+            part = ("\n" if index else "") + fragment
+            out.write(part)
+            digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def highlighting_macros():
+    """LaTeX macros for highlighted code blocks, normally emitted by pandoc per document."""
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        macros_template = Path(temp_dir) / "macros.latex"
+        macros_template.write_text("$highlighting-macros$\n", encoding="utf-8")
+        try:
+            result = processes.run(
+                [PANDOC] + FRAGMENT_ARGS + ["--template", str(macros_template)],
+                input="```python\npass\n```\n"
+            )
+        except FileNotFoundError:
+            raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+
+    if result.returncode != 0:
+        raise ConversionError("Pandoc conversion failed", result.stderr, cause="markdown_failed")
+    return result.stdout.strip()
+
+
+def write_merged_markdown(documents, dest_path):
+    """Stream (filename, content) pairs into one Markdown file, adding a heading per file when there are several."""
+
+    with open(dest_path, "w", encoding="utf-8") as out:
+        for filename, file_content in documents:
+            # Add file separator if multiple files
+            if len(documents) > 1:
+                out.write(f"# {filename.rsplit('.', 1)[0]}\n\n")
+
+            _copy_source(file_content, out)
+            out.write("\n\n")
+
+
+@functools.lru_cache(maxsize=None)
+def pandoc_version():
+    """Version of the pandoc executable as a tuple of ints, or () if it cannot be run."""
+
+    try:
+        result = processes.run([PANDOC, "--version"])
+    except FileNotFoundError:
+        return ()
+    match = re.search(r"(\d+(?:\.\d+)+)", result.stdout.split("\n", 1)[0])
+    return tuple(int(part) for part in match.group(1).split(".")) if match else ()
+
+
+def _embed_resources_arg():
+    # --self-contained was deprecated in pandoc 2.19 in favour of --embed-resources
+    return "--embed-resources" if pandoc_version() >= (2, 19) else "--self-contained"
+
+
+def preview_args(options):
+    """pandoc arguments for the HTML preview, mirroring the metadata and TOC of the PDF."""
+
+    # Images (e.g. from uploaded bundles) are inlined, since the page is shown from a string
+    args = PREVIEW_ARGS + [_embed_resources_arg()]
+    if options.title.strip():
+        args.extend(["-M", f"title={options.title.strip()}"])
+    if options.author.strip():
+        args.extend(["-M", f"author={options.author.strip()}"])
+    args.extend(["-M", f"date={options.date}"])
+    if options.toc:
+        args.extend(["--toc", "--toc-depth=3"])
+
+    # Fonts only matter if the browser has them; no need to check the registry here
+    font_pair = fonts.FONT_MAPPING.get(options.font_family)
+    if font_pair:
+        main_font, mono_font = font_pair
+        args.extend(["-V", f"mainfont={main_font}", "-V", f"monofont={mono_font}"])
+    return args
+
+
+def render_preview(documents, options, cache=None):
+    """Render (filename, content) pairs to a standalone HTML page for previewing.
+
+    Uses the same merge as the PDF (write_merged_markdown) but skips the Eisvogel
+    template and xelatex, so it takes a single fast pandoc run. cache is an optional
+    RenderCache for finished previews. At most PREVIEW_WORKERS (MD2PDF_PREVIEW_WORKERS)
+    previews run at once; raises QueueFull when no slot frees up within PREVIEW_WAIT
+    seconds. Returns the HTML as a string.
+    """
+
+    with tempfile.TemporaryDirectory() as temp_dir, metrics.stage("preview"):
+        merged_md_path = Path(temp_dir) / "merged.md"
+        write_merged_markdown(documents, merged_md_path)
+        args = preview_args(options)
+
+        cache_key = None
+        if cache is not None:
+            cache_key = render_key(_source_digest(merged_md_path), args, "")
+            html = cache.get(cache_key)
+            if html is not None:
+                return html.decode("utf-8")
+
+        if not _preview_slots.acquire(timeout=PREVIEW_WAIT):
+            raise QueueFull("The previewer is busy. Please try again shortly.")
+        try:
+            result = processes.run([PANDOC, str(merged_md_path)] + args)
+        except FileNotFoundError:
+            raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+        finally:
+            _preview_slots.release()
+        if result.returncode != 0:
+            raise ConversionError("Preview rendering failed", result.stderr, cause="preview_failed")
+
+        if cache is not None:
+            cache.put(cache_key, result.stdout.encode("utf-8"))
+        return result.stdout
+
+
+def prepare_template(work_dir, options, dump_marker=False):
+    """Locate the processed Eisvogel template and copy the background into work_dir.
+
+    Returns (template_text, template_path, background_path); background_path is None
+    when no title page background is used. The template file itself is shared across
+    renders and only written once per variant.
+    """
+
+    latex_template = create_eisvogel_template(
+        options.gray_code_background, options.code_font_size, options.line_numbers, options.title_page,
+        dump_marker=dump_marker
+    )
+    template_path = _template_file(options.title_page, dump_marker)
+
+    # The title page background is passed to Eisvogel through the titlepage-background variable
+    background_dest = None
+    if options.title_page and BACKGROUND_PATH.exists():
+        # Use background PNG directly
+        background_dest = Path(work_dir) / "background.png"
+        shutil.copy2(BACKGROUND_PATH, background_dest)
+
+    return latex_template, template_path, background_dest
+
+
+def resolve_fonts(font_family):
+    """Return (main_font, mono_font) for a font choice, or None to keep the template default.
+
+    Uses the process-wide font registry, so no fontconfig subprocess runs per render.
+    """
+
+    try:
+        return fonts.get_registry().resolve(font_family)
+    except ValueError as e:
+        raise ConversionError(str(e), cause="font_unavailable")
+
+
+def check_sources(documents, options, work_dir=None):
+    """Preflight the Markdown sources (see preflight.py) before any pandoc or xelatex run.
+
+    Returns (documents, warnings), with auto-fixes applied when options.auto_fix is
+    set. Raises ConversionError listing every problem when one of them would make
+    xelatex fail, so bad input is rejected in milliseconds.
+    """
+
+    documents, issues = preflight.check_documents(
+        documents, resolve_fonts(options.font_family), auto_fix=options.auto_fix, work_dir=work_dir
+    )
+    errors = [issue for issue in issues if issue.fatal]
+    if errors:
+        raise ConversionError(
+            f"Found {len(errors)} problem(s) that would make XeLaTeX fail",
+            preflight.format_issues(issues), cause="preflight_failed"
+        )
+    return documents, [f"{issue.location}: {issue.message}" for issue in issues]
+
+
+def build_pandoc_cmd(merged_md_path, pdf_path, template_path, background_path, options, body_path=None):
+    """Map PdfOptions onto the pandoc/xelatex command line.
+
+    With body_path, the document body is taken from that pre-converted LaTeX file and
+    merged_md_path only needs to be an empty Markdown document.
+    """
+
+    pandoc_cmd = [
+        PANDOC,
+        str(merged_md_path),
+        "-o", str(pdf_path),
+        "--pdf-engine=xelatex",
+        "--template", str(template_path),
+        "-V", f"geometry:margin={options.margin}",
+        "-V", "linkcolor=blue",
+        "-V", "urlcolor=blue",
+        "--standalone"
+    ]
+
+    # Note: Line numbers are handled in the LaTeX template
+    # The line_numbers flag is passed to create_eisvogel_template
+
+    # Add metadata
+    if options.title.strip():
+        pandoc_cmd.extend(["-M", f"title={options.title.strip()}"])
+    if options.author.strip():
+        pandoc_cmd.extend(["-M", f"author={options.author.strip()}"])
+    pandoc_cmd.extend(["-M", f"date={options.date}"])
+
+    # Enable title page when custom title page is requested
+    if options.title_page:
+        pandoc_cmd.extend(["-V", "titlepage=true"])
+        # Add background image support
+        if background_path and background_path.exists():
+            pandoc_cmd.extend(["-V", f"titlepage-background={background_path}"])
+        # Set title page colors for better visibility
+        pandoc_cmd.extend(["-V", "titlepage-text-color=5F5F5F"])
+        pandoc_cmd.extend(["-V", "titlepage-rule-color=435488"])
+        pandoc_cmd.extend(["-V", "titlepage-rule-height=4"])
+
+    # Enable Eisvogel code highlighting with gray backgrounds
+    # Enable listings package for gray code backgrounds
+    pandoc_cmd.extend(["-V", "listings=true"])
+    # Ensure line numbers are shown if requested
+    if not options.line_numbers:
+        pandoc_cmd.extend(["-V", "listings-disable-line-numbers=true"])
+    # Set code block font size if specified
+    if options.code_font_size != "9pt":  # 9pt is default
+        font_size_map = {"8pt": "\\footnotesize", "10pt": "\\normalsize", "11pt": "\\large"}
+        if options.code_font_size in font_size_map:
+            pandoc_cmd.extend(["-V", f"code-block-font-size={font_size_map[options.code_font_size]}"])
+    # Add highlight style to activate Eisvogel's syntax highlighting with listings
+    pandoc_cmd.extend([f"--highlight-style={HIGHLIGHT_STYLE}"])
+
+    if body_path is not None:
+        pandoc_cmd.extend(["--include-after-body", str(body_path)])
+        for variable in ASSEMBLY_VARIABLES:
+            pandoc_cmd.extend(["-V", variable])
+        pandoc_cmd.extend(["-V", f"highlighting-macros={highlighting_macros()}"])
+
+    # Add table of contents if requested
+    if options.toc:
+        pandoc_cmd.extend(["--toc", "--toc-depth=3"])
+
+    font_pair = resolve_fonts(options.font_family)
+    if font_pair:
+        main_font, mono_font = font_pair
+        pandoc_cmd.extend(["-V", f"mainfont={main_font}"])
+        pandoc_cmd.extend(["-V", f"monofont={mono_font}"])
+
+    return pandoc_cmd
+
+
+def _run_pandoc(pandoc_cmd):
+    try:
+        return processes.run(pandoc_cmd)
+    except FileNotFoundError:
+        raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+
+
+def render_workers():
+    """How many chapter shards may be typeset at once (MD2PDF_RENDER_WORKERS, default: CPU count).
+
+    This is per conversion: the shards run on threads of their own, outside the
+    MD2PDF_WORKERS bound of the job queue, so up to MD2PDF_WORKERS x
+    MD2PDF_RENDER_WORKERS xelatex processes can run at once.
+    """
+    return max(1, int(os.environ.get("MD2PDF_RENDER_WORKERS") or os.cpu_count() or 1))
+
+
+def group_chapters(sizes, shards):
+    """Split chapters into at most `shards` contiguous groups of similar total size.
+
+    sizes are the chapter sizes in document order; returns lists of chapter indices.
+    """
+
+    total = sum(sizes) or 1
+    groups, current, accumulated = [], [], 0
+    for index, size in enumerate(sizes):
+        current.append(index)
+        accumulated += size
+        groups_left = shards - len(groups) - 1
+        chapters_left = len(sizes) - index - 1
+        if groups_left > 0 and (
+            accumulated >= total * (len(groups) + 1) / shards or chapters_left == groups_left
+        ):
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _latex_escape(text):
+    replacements = {
+        "\\": "\\textbackslash{}", "&": "\\&", "%": "\\%", "$": "\\$", "#": "\\#", "_": "\\_",
+        "{": "\\{", "}": "\\}", "~": "\\textasciitilde{}", "^": "\\textasciicircum{}",
+    }
+    return "".join(replacements.get(char, char) for char in text)
+
+
+def run_xelatex(tex_path, min_passes=1, failure="XeLaTeX failed"):
+    """Typeset tex_path in its own directory, rerunning until references settle.
+
+    Runs at least min_passes and at most MAX_XELATEX_PASSES passes. Returns the
+    processes.run result of every pass, which carries its rusage and elapsed time.
+    Raises ConversionError with the message failure when a pass fails.
+    """
+
+    cmd = ["xelatex", "-interaction=nonstopmode", "-halt-on-error", tex_path.name]
+    results = []
+    while len(results) < MAX_XELATEX_PASSES:
+        try:
+            result = processes.run(cmd, cwd=tex_path.parent)
+        except FileNotFoundError:
+            raise ConversionError("XeLaTeX executable not found", cause="xelatex_missing")
+        results.append(result)
+        if result.returncode != 0:
+            # xelatex reports errors on stdout
+            raise ConversionError(failure, result.stdout[-4000:], cause="render_failed")
+
+        log_text = tex_path.with_suffix(".log").read_text(encoding="utf-8", errors="replace")
+        rerun = "Rerun to get" in log_text or "Label(s) may have changed" in log_text
+        if not rerun and len(results) >= min_passes:
+            break
+    return results
+
+
+def _brace_groups(text, position, count):
+    """The contents of count consecutive {...} groups starting at position (spaces between
+    them are skipped), or None if text does not have them."""
+
+    groups = []
+    while len(groups) < count:
+        while position < len(text) and text[position] == " ":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            return None
+        depth = 0
+        for end in range(position, len(text)):
+            char = text[end]
+            if char == "\\":
+                continue
+            if char == "{" and text[end - 1] != "\\":
+                depth += 1
+            elif char == "}" and text[end - 1] != "\\":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            return None
+        groups.append(text[position + 1:end])
+        position = end + 1
+    return groups
+
+
+def toc_entries(aux_text):
+    """(level, heading, page) for every table of contents entry in an .aux file.
+
+    heading is the LaTeX of the entry without its \\numberline; entries deeper than
+    TOC_LEVELS are skipped.
+    """
+
+    entries = []
+    position = aux_text.find(TOC_ENTRY_START)
+    while position >= 0:
+        groups = _brace_groups(aux_text, position + len(TOC_ENTRY_START), 3)
+        if groups is not None:
+            level, heading, page = groups
+            if level in TOC_LEVELS and page.strip().isdigit():
+                numbered = heading.find("\\numberline")
+                if numbered >= 0:
+                    number = _brace_groups(heading, numbered + len("\\numberline"), 1)
+                    if number is not None:
+                        # Drop the "\\numberline {1.2}" in front of the title
+                        rest = heading[numbered + len("\\numberline"):].lstrip(" ")
+                        heading = heading[:numbered] + rest[len(number[0]) + 2:]
+                entries.append((level, heading.strip(), int(page)))
+        position = aux_text.find(TOC_ENTRY_START, position + 1)
+    return entries
+
+
+def _render_shard(shard_cmd, tex_path, chapter_count):
+    """Worker: pandoc -> .tex -> xelatex for one shard.
+
+    Returns (pdf_path, start pages, toc entries, usages).
+    """
+
+    try:
+        result = processes.run(shard_cmd)
+    except FileNotFoundError:
+        raise ConversionError("Pandoc executable not found", cause="pandoc_missing")
+    if result.returncode != 0:
+        raise ConversionError("Pandoc conversion failed", result.stderr, cause="render_failed")
+    passes = run_xelatex(tex_path, failure="XeLaTeX failed on a chapter")
+    usages = [result.rusage] + [xelatex.rusage for xelatex in passes]
+
+    # Page on which each chapter starts, from the labels written after its heading
+    aux_text = tex_path.with_suffix(".aux").read_text(encoding="utf-8", errors="replace")
+    pages = {int(chapter): int(page) for chapter, page in CHAPTER_LABEL_RE.findall(aux_text)}
+    start_pages = [pages.get(chapter, 1) for chapter in range(chapter_count)]
+    return tex_path.with_suffix(".pdf"), start_pages, toc_entries(aux_text), usages
+
+
+def render_sharded(chapters, options, work_dir, pdf_path, shards):
+    """Typeset chapters in parallel shards and stitch them into pdf_path.
+
+    chapters are (title, heading_fragment, body_fragment) triples in document order.
+    Every shard is rendered with the Eisvogel template but without title page, table
+    of contents, headers or footers. The final document is an ordinary Eisvogel
+    render whose body includes the shard pages with pdfpages: it supplies the title
+    page, headers, footers and continuous page numbers, and registers the headings
+    of every shard (read from its .aux file, down to subsubsections like --toc-depth=3)
+    in the table of contents and the PDF bookmarks. Links inside chapters are not
+    kept, as pdfpages only copies the page content.
+
+    The shards run on their own threads, in addition to the queue worker that called
+    this (see render_workers); they share that job's limits.
+    """
+
+    work_dir = Path(work_dir)
+    empty_md_path = work_dir / "document.md"
+    shard_options = replace(options, title="", author="", title_page=False, toc=False)
+    _, shard_template_path, _ = prepare_template(work_dir, shard_options)
+
+    groups = group_chapters([len(heading) + len(body) for _, heading, body in chapters], shards)
+    jobs = []
+    for index, group in enumerate(groups):
+        shard_dir = work_dir / f"shard-{index:03d}"
+        shard_dir.mkdir()
+        body_path = shard_dir / "body.tex"
+        with open(body_path, "w", encoding="utf-8") as out:
+            for position, chapter_index in enumerate(group):
+                _, heading, body = chapters[chapter_index]
+                if position:
+                    out.write("\n\\clearpage\n")
+                out.write(heading)
+                out.write(f"\\label{{{CHAPTER_LABEL.format(position)}}}\n\n")
+                out.write(body)
+
+        tex_path = shard_dir / "shard.tex"
+        shard_cmd = build_pandoc_cmd(
+            empty_md_path, tex_path, shard_template_path, None, shard_options, body_path=body_path
+        )
+        shard_cmd = [arg for arg in shard_cmd if not arg.startswith("--pdf-engine")]
+        for variable in SHARD_VARIABLES:
+            shard_cmd.extend(["-V", variable])
+        jobs.append((shard_cmd, tex_path, len(group)))
+
+    # Shards count against the limits of the job that started them
+    scope = processes.current()
+
+    def render(job):
+        with processes.within(scope):
+            return _render_shard(*job)
+
+    with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="md2pdf-shard") as pool:
+        rendered = list(pool.map(render, jobs))
+
+    # Stitch the shards into the final document
+    stitch_body_path = work_dir / "stitch.tex"
+    with open(stitch_body_path, "w", encoding="utf-8") as out:
+        for index, (group, (shard_pdf, start_pages, entries, usages)) in enumerate(zip(groups, rendered)):
+            for usage in usages:
+                metrics.record_process(usage)
+            if not entries:
+                # No entries in the .aux (e.g. headings the template keeps out of the
+                # TOC): one entry per file, at the page its chapter starts
+                entries = [
+                    ("section", _latex_escape(chapters[chapter_index][0]), page)
+                    for chapter_index, page in zip(group, start_pages)
+                ]
+            toc = [
+                f"{page},{level},{TOC_LEVELS[level]},{{{heading}}},md2pdf-shard-{index}-{position}"
+                for position, (level, heading, page) in enumerate(entries)
+            ]
+            out.write(
+                f"\\includepdf[pages=-,pagecommand={{}},addtotoc={{{','.join(toc)}}}]"
+                f"{{{shard_pdf.as_posix()}}}\n"
+            )
+
+    stitch_header_path = work_dir / "stitch-header.tex"
+    stitch_header_path.write_text(STITCH_HEADER, encoding="utf-8")
+    _, template_path, background_path = prepare_template(work_dir, options)
+    stitch_cmd = build_pandoc_cmd(
+        empty_md_path, pdf_path, template_path, background_path, options, body_path=stitch_body_path
+    )
+    stitch_cmd.extend(["--include-in-header", str(stitch_header_path)])
+    return _run_pandoc(stitch_cmd)
+
+
+def convert(documents, options, cache=None, progress=None, fragment_cache=None, output_path=None):
+    """Render (filename, content) pairs to PDF bytes.
+
+    content is the Markdown text or the Path of a UTF-8 file (see uploads.spool_uploads).
+    With output_path, the PDF is copied there instead of being read into memory and
+    the result carries pdf_path rather than pdf_bytes.
+
+    The sources are preflighted first (see check_sources). Each file is then converted
+    to a LaTeX fragment on its own (cached in fragment_cache when given), so
+    reordering or toggling files only re-converts what changed; documents with images
+    xelatex cannot include are rendered from the merged Markdown instead (see
+    needs_pandoc_images). cache is an
+    optional RenderCache for finished PDFs; progress is an optional
+    callable(percent, message) used by the UI to report the current step.
+    """
+
+    def report(percent, message):
+        if progress:
+            progress(percent, message)
+
+    # Fail fast on fonts that are not installed, before any pandoc work
+    resolve_fonts(options.font_family)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        warnings = []
+        if preflight.enabled():
+            with metrics.stage("preflight"):
+                documents, warnings = check_sources(documents, options, work_dir=temp_dir)
+            metrics.annotate(preflight_warnings=len(warnings))
+
+        # Step 1: Convert markdown files to LaTeX fragments and assemble them in order
+        report(25, "📝 Processing Markdown files...")
+        with metrics.stage("merge"):
+            sources = markdown_sources(documents)
+            if any(needs_pandoc_images(source) for source in sources):
+                # pandoc renders the merged Markdown itself, handling the images
+                fragments, reused, body_path = None, 0, None
+                input_path = Path(temp_dir) / "merged.md"
+                write_merged_markdown(documents, input_path)
+                body_digest = _source_digest(input_path)
+            else:
+                fragments, reused = convert_fragments(sources, fragment_cache, work_dir=temp_dir)
+                body_path = Path(temp_dir) / "body.tex"
+                body_digest = write_body(fragments, body_path)
+                input_path = Path(temp_dir) / "document.md"
+                input_path.write_text("", encoding="utf-8")
+        fragment_stats = {"fragments_total": len(sources) if fragments is not None else 0, "fragments_reused": reused}
+        metrics.annotate(**fragment_stats)
+        result_fields = {**fragment_stats, "warnings": warnings}
+
+        # Several files can be typeset as parallel chapter shards (see render_sharded)
+        shards = 1
+        if options.parallel_chapters and len(documents) > 1 and fragments is not None:
+            shards = min(render_workers(), len(documents))
+        chapters = None
+        if shards > 1:
+            # markdown_sources emits a heading source and the file itself per document
+            chapters = [
+                (filename.rsplit('.', 1)[0], fragments[2 * index], fragments[2 * index + 1])
+                for index, (filename, _) in enumerate(documents)
+            ]
+        del fragments
+        metrics.annotate(shards=shards)
+
+        # Step 2: Prepare LaTeX template and background
+        report(50, "🎨 Preparing professional template...")
+        with metrics.stage("template"):
+            pdf_path = Path(temp_dir) / "output.pdf"
+            latex_template, template_path, background_path = prepare_template(temp_dir, options)
+            pandoc_cmd = build_pandoc_cmd(
+                input_path, pdf_path, template_path, background_path, options, body_path=body_path
+            )
+
+        # Look up the render cache before paying for a full xelatex run.
+        # The temp dir differs on every run, so strip it from the key inputs.
+        optimize = postprocess.enabled()
+        cache_key = None
+        if cache is not None:
+            background_bytes = background_path.read_bytes() if background_path else None
+            cache_key = render_key(
+                body_digest,
+                [arg.replace(temp_dir, "<workdir>") for arg in pandoc_cmd[1:]]
+                + ([f"<shards={shards}>"] if shards > 1 else [])
+                + (["<optimized>"] if optimize else []),
+                latex_template.replace(temp_dir, "<workdir>"),
+                background_bytes
+            )
+            if output_path is not None:
+                if cache.copy_to(cache_key, output_path):
+                    metrics.annotate(from_cache=True)
+                    return ConversionResult(
+                        pdf_path=output_path, pdf_size=os.path.getsize(output_path), from_cache=True,
+                        **result_fields
+                    )
+            else:
+                pdf_bytes = cache.get(cache_key)
+                if pdf_bytes is not None:
+                    metrics.annotate(from_cache=True)
+                    return ConversionResult(pdf_bytes, pdf_size=len(pdf_bytes), from_cache=True, **result_fields)
+            metrics.annotate(from_cache=False)
+
+        # pandoc drives xelatex itself, so the xelatex passes are part of this stage
+        # (their CPU time and memory are included in the child usage)
+        report(75, "⚙️ Running Pandoc conversion...")
+        with metrics.stage("render"):
+            result = None
+            fmt = latex_format.format_for(pandoc_cmd) if shards == 1 else None
+            if fmt is not None:
+                _, format_template_path, _ = prepare_template(temp_dir, options, dump_marker=True)
+                format_cmd = [
+                    str(format_template_path) if arg == str(template_path) else arg
+                    for arg in pandoc_cmd
+                ]
+                format_cmd.append(f"--pdf-engine-opt=-fmt={fmt}")
+                result = _run_pandoc(format_cmd)
+
+            if shards > 1:
+                result = render_sharded(chapters, options, temp_dir, pdf_path, shards)
+            elif result is None or result.returncode != 0:
+                plain_result = _run_pandoc(pandoc_cmd)
+                if result is not None and plain_result.returncode == 0:
+                    # Only the precompiled preamble broke this render; stop using it
+                    latex_format.mark_failed(fmt)
+                result = plain_result
+
+            if result.returncode != 0:
+                raise ConversionError("Pandoc conversion failed", result.stderr, cause="render_failed")
+
+        # Step 4: Shrink and linearize the PDF for mobile downloads and e-readers
+        original_size = 0
+        if optimize:
+            report(90, "🗜️ Optimizing PDF...")
+            with metrics.stage("optimize"):
+                original_size, _ = postprocess.optimize_pdf(pdf_path)
+
+        pdf_size = os.path.getsize(pdf_path)
+        metrics.annotate(pdf_bytes=pdf_size, original_bytes=original_size or pdf_size)
+        if cache is not None:
+            cache.put_file(cache_key, pdf_path)
+
+        if output_path is not None:
+            with metrics.stage("read"):
+                shutil.copyfile(pdf_path, output_path)
+            return ConversionResult(
+                pdf_path=output_path, pdf_size=pdf_size, original_size=original_size, **result_fields
+            )
+
+        # Read the generated PDF
+        with metrics.stage("read"):
+            with open(pdf_path, "rb") as pdf_file:
+                pdf_bytes = pdf_file.read()
+
+        return ConversionResult(pdf_bytes, pdf_size=pdf_size, original_size=original_size, **result_fields)
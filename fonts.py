@@ -0,0 +1,143 @@
+import subprocess
+import threading
+
+
+# Font choice offered in the UI -> (main font, mono font) passed to xelatex
+FONT_MAPPING = {
+    "Liberation Serif": ("Liberation Serif", "Liberation Mono"),
+    "DejaVu Serif": ("DejaVu Serif", "DejaVu Sans Mono"),
+    "Latin Modern": ("Latin Modern Roman", "Latin Modern Mono")
+}
+
+# Latin Modern ships with TeX Live; xelatex finds it in the TeX tree even when
+# fontconfig does not list it, so it is always a safe fallback
+ALWAYS_AVAILABLE = {"Latin Modern"}
+
+AUTO_DETECT = "Auto-detect"
+DEFAULT = "Default"
+
+
+class FontRegistry:
+    """Installed font families, scanned once per process from fontconfig."""
+
+    def __init__(self, families, scanned=True):
+        self.families = set(families)
+        # False when fontconfig could not be queried; choices are then unverified
+        self.scanned = scanned
+        # family -> frozenset of code points, filled on demand by coverage()
+        self._coverage = {}
+        self._coverage_lock = threading.Lock()
+
+    @classmethod
+    def scan(cls):
+        """Build the registry from a single fc-list call."""
+
+        try:
+            result = subprocess.run(
+                ["fc-list", "--format", "%{family}\n"],
+                capture_output=True, text=True
+            )
+        except FileNotFoundError:
+            # fc-list not available
+            return cls([], scanned=False)
+
+        if result.returncode != 0:
+            return cls([], scanned=False)
+
+        families = set()
+        for line in result.stdout.splitlines():
+            # A font lists all its family name aliases separated by commas
+            for family in line.split(","):
+                family = family.strip()
+                if family:
+                    families.add(family)
+        return cls(families)
+
+    def has_family(self, family):
+        return family in self.families
+
+    def coverage(self, family):
+        """Code points the installed faces of family can render, or None when unknown.
+
+        Queried from fontconfig once per family. Fonts xelatex finds only in the TeX
+        tree (Latin Modern) are not listed there, so their coverage is unknown.
+        """
+
+        with self._coverage_lock:
+            if family not in self._coverage:
+                self._coverage[family] = self._scan_coverage(family)
+            return self._coverage[family]
+
+    def _scan_coverage(self, family):
+        if not self.scanned or not self.has_family(family):
+            return None
+        try:
+            result = subprocess.run(
+                ["fc-list", "--format", "%{charset}\n", f":family={family}"],
+                capture_output=True, text=True
+            )
+        except FileNotFoundError:
+            return None
+        if result.returncode != 0:
+            return None
+
+        # Every face prints its charset as hex ranges, e.g. "20-7e a0-17f 2013"
+        code_points = set()
+        for token in result.stdout.split():
+            start, _, end = token.partition("-")
+            try:
+                code_points.update(range(int(start, 16), int(end or start, 16) + 1))
+            except ValueError:
+                continue
+        return frozenset(code_points) or None
+
+    def available(self, choice):
+        """Whether a UI font choice can be rendered on this machine."""
+
+        if choice in (AUTO_DETECT, DEFAULT) or choice in ALWAYS_AVAILABLE:
+            return True
+        if choice not in FONT_MAPPING:
+            return False
+        if not self.scanned:
+            return True
+        main_font, mono_font = FONT_MAPPING[choice]
+        return self.has_family(main_font) and self.has_family(mono_font)
+
+    def choices(self, candidates):
+        """Filter the UI font choices down to the ones that are installed."""
+        return [choice for choice in candidates if self.available(choice)]
+
+    def resolve(self, choice):
+        """Return (main_font, mono_font) for a font choice, or None to keep the template default.
+
+        Raises ValueError for a choice whose fonts are not installed.
+        """
+
+        # Handle font selection - avoid Times font
+        if choice == AUTO_DETECT:
+            # Check for Liberation fonts first (most reliable), otherwise use
+            # Latin Modern (always available with XeTeX) - safer than generic "serif"
+            if self.scanned and self.available("Liberation Serif"):
+                return FONT_MAPPING["Liberation Serif"]
+            return FONT_MAPPING["Latin Modern"]
+
+        if choice == DEFAULT:
+            return None
+
+        if not self.available(choice):
+            raise ValueError(f"Font '{choice}' is not installed on this server. Choose another font family.")
+        return FONT_MAPPING.get(choice)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide font registry, scanned on first use."""
+
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FontRegistry.scan()
+        return _registry
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import processes
+from render_cache import RenderCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional; installed with streamlit
+    Image = None
+
+
+# xelatex can include these as they are (after downscaling for raster formats)
+PASSTHROUGH_EXTENSIONS = {".pdf", ".eps"}
+# Raster formats Pillow re-encodes to PNG or JPEG
+RASTER_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+IMAGE_EXTENSIONS = PASSTHROUGH_EXTENSIONS | RASTER_EXTENSIONS
+# What \includegraphics under xelatex reads; other formats need converting first
+XELATEX_EXTENSIONS = PASSTHROUGH_EXTENSIONS | {".png", ".jpg", ".jpeg"}
+
+# A4 paper width; images are never wider than the page at the target DPI
+PAGE_WIDTH_INCHES = 8.27
+DEFAULT_DPI = 150
+JPEG_QUALITY = 85
+
+
+def is_image(path):
+    return Path(path).suffix.lower() in IMAGE_EXTENSIONS
+
+
+def xelatex_can_include(target):
+    """Whether xelatex can include the image target of a Markdown link as it is.
+
+    Remote and data: URLs, SVG, GIF, WebP and the like are only handled when pandoc
+    renders the PDF itself (it fetches and converts them). Targets without an
+    extension are left to xelatex, which tries its own.
+    """
+
+    if "://" in target or target.startswith("data:"):
+        return False
+    suffix = os.path.splitext(target.split("?", 1)[0].split("#", 1)[0])[1].lower()
+    return not suffix or suffix in XELATEX_EXTENSIONS
+
+
+def create_cache():
+    """The RenderCache for processed images.
+
+    Documents link straight to the cached files, so an entry is kept for a job's time
+    limit after it was last used: eviction by a concurrent preview or render cannot
+    delete an image between spooling a document and typesetting it.
+    """
+
+    keep_seconds = processes.JobScope().timeout or processes.DEFAULT_JOB_TIMEOUT
+    return RenderCache(kind="images", suffix="", keep_seconds=keep_seconds)
+
+
+def max_pixels():
+    """Longest side, in pixels, that an image keeps (MD2PDF_IMAGE_DPI across the page width)."""
+    dpi = float(os.environ.get("MD2PDF_IMAGE_DPI", DEFAULT_DPI))
+    return int(PAGE_WIDTH_INCHES * dpi)
+
+
+def _digest(src_path, settings):
+    digest = hashlib.sha256(settings.encode("utf-8"))
+    with open(src_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _output_suffix(src_path):
+    suffix = Path(src_path).suffix.lower()
+    if suffix in PASSTHROUGH_EXTENSIONS or Image is None:
+        return suffix
+    return ".jpg" if suffix in (".jpg", ".jpeg") else ".png"
+
+
+def _reencode(src_path, dest_path, limit):
+    with Image.open(src_path) as image:
+        # Apply the camera's orientation before dropping the EXIF data
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > limit:
+            image.thumbnail((limit, limit), Image.LANCZOS)
+
+        if dest_path.suffix == ".jpg":
+            image.convert("RGB").save(dest_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA")
+            image.save(dest_path, "PNG", optimize=True)
+
+
+def prepare_image(src_path, cache=None, work_dir=None):
+    """Downscale and recompress an image for the PDF, once per distinct image.
+
+    Returns the path xelatex should include. Results are stored in cache (a
+    RenderCache created with an empty suffix) keyed by the image content and the
+    settings, so the same screenshot is only processed once; without a cache they
+    are written to work_dir. Files Pillow cannot read are used as they are.
+    """
+
+    src_path = Path(src_path)
+    if src_path.suffix.lower() not in IMAGE_EXTENSIONS:
+        return src_path
+
+    limit = max_pixels()
+    suffix = _output_suffix(src_path)
+    key = _digest(src_path, f"{limit}:{JPEG_QUALITY}:{suffix}") + suffix
+
+    if cache is not None:
+        cached = cache.get_path(key)
+        if cached is not None:
+            return cached
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        processed = Path(temp_dir) / f"image{suffix}"
+        if suffix in PASSTHROUGH_EXTENSIONS or Image is None:
+            shutil.copyfile(src_path, processed)
+        else:
+            try:
+                _reencode(src_path, processed, limit)
+            except Exception:
+                # Unreadable, truncated or suspiciously large (decompression bomb) images
+                # are passed through; xelatex reports them like any other bad input
+                return src_path
+
+        if cache is not None:
+            stored = cache.put_file(key, processed)
+            if stored is not None:
+                return stored
+
+        dest = Path(work_dir or src_path.parent) / key
+        shutil.move(str(processed), dest)
+        return dest
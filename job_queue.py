@@ -0,0 +1,197 @@
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import metrics
+import processes
+
+
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_PENDING = 8
+# Finished jobs kept around so clients can still fetch their result
+FINISHED_JOBS_KEPT = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(RuntimeError):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A unit of work tracked by JobQueue, with progress reporting for the UI."""
+
+    def __init__(self, task):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.status = QUEUED
+        self.percent = 0
+        self.message = "⏳ Waiting in queue..."
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        # Time, CPU and memory limits of the processes the task starts; cancel() stops them
+        self.scope = processes.JobScope()
+
+    def report(self, percent, message):
+        """Progress callback handed to the task; safe to call from the worker thread."""
+        self.percent = percent
+        self.message = message
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False if timeout expired first."""
+        return self._done.wait(timeout)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        """Return the task's return value, re-raising its exception if it failed."""
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def queue_wait(self):
+        """Seconds spent waiting for a worker."""
+        end = self.started_at or time.time()
+        return end - self.submitted_at
+
+
+class JobQueue:
+    """In-process job queue with a fixed number of worker threads and a bounded backlog.
+
+    Limiting workers caps how many pandoc/xelatex processes run at once; limiting the
+    backlog rejects new work instead of piling up memory under bursty load.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        if workers is None:
+            workers = int(os.environ.get("MD2PDF_WORKERS", DEFAULT_WORKERS))
+        if max_pending is None:
+            max_pending = int(os.environ.get("MD2PDF_MAX_QUEUE", DEFAULT_MAX_PENDING))
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._running = 0
+        self._rejected = 0
+        self._condition = threading.Condition()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"md2pdf-worker-{i}", daemon=True)
+            thread.start()
+
+    def submit(self, task):
+        """Queue task(job) for execution and return its Job.
+
+        Raises QueueFull when max_pending jobs are already waiting.
+        """
+
+        job = Job(task)
+        with self._condition:
+            if len(self._pending) >= self.max_pending:
+                self._rejected += 1
+                raise QueueFull(
+                    f"The converter is busy ({len(self._pending)} documents waiting). Please try again shortly."
+                )
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._prune()
+            self._condition.notify()
+        return job
+
+    def cancel(self, job):
+        """Cancel a job: drop it from the queue if it is waiting, or kill its processes if running.
+
+        Returns False when the job had already finished.
+        """
+
+        with self._condition:
+            if job in self._pending:
+                self._pending.remove(job)
+                job._error = processes.Cancelled("The conversion was cancelled")
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                job.task = None
+                job._done.set()
+                return True
+        if job.done():
+            return False
+        job.scope.cancel()
+        return True
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """1-based position among waiting jobs, or 0 once the job has started."""
+        with self._condition:
+            for index, pending in enumerate(self._pending, 1):
+                if pending is job:
+                    return index
+        return 0
+
+    def stats(self):
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "rejected": self._rejected,
+            }
+
+    def _prune(self):
+        # Forget the oldest finished jobs once we hold too many
+        finished = [job_id for job_id, job in self._jobs.items() if job.done()]
+        for job_id in itertools.islice(finished, max(0, len(finished) - FINISHED_JOBS_KEPT)):
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                job = self._pending.popleft()
+                self._running += 1
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.message = "🚀 Starting conversion..."
+            with metrics.trace() as trace, processes.within(job.scope):
+                try:
+                    job._result = job.task(job)
+                    job.status = DONE
+                except processes.Cancelled as e:
+                    job._error = e
+                    job.status = CANCELLED
+                except Exception as e:
+                    job._error = e
+                    job.status = FAILED
+                finally:
+                    job.finished_at = time.time()
+                    job.task = None
+                    with self._condition:
+                        self._running -= 1
+            try:
+                metrics.job_finished(job, trace)
+            finally:
+                job._done.set()
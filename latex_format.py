@@ -0,0 +1,206 @@
+"""Optional precompiled LaTeX preamble formats for xelatex.
+
+The Eisvogel preamble loads a long list of heavy packages (KOMA-Script, tikz,
+listings, mdframed, caption, ...) that xelatex re-parses on every run. With
+MD2PDF_PRECOMPILED_PREAMBLE=1 we dump those packages once into a custom format
+with mylatexformat and start xelatex from it, so each run skips loading them.
+
+Native (fontspec) fonts cannot be stored in a XeTeX format, so font packages
+and everything that has to come after them (hyperref, bookmark, ...) are still
+loaded normally on each run. Loading an already-loaded package with the same
+options is a no-op in LaTeX, which is what lets the rest of the document
+preamble run unchanged on top of the format.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import processes
+
+
+DEFAULT_FORMAT_DIR = Path(tempfile.gettempdir()) / "md2pdf-cache" / "formats"
+
+# Marker inserted right after \documentclass in the template variant used with a
+# format: mylatexformat skips the document preamble up to this point at run time.
+DUMP_MARKER = "\\endofdump"
+
+# Packages that must not be dumped: native font handling (XeTeX cannot dump
+# native fonts), packages that behave differently depending on the fonts, and
+# hyperref and friends which have to be loaded late.
+EXCLUDED_PACKAGES = {
+    "fontspec", "unicode-math", "mathspec", "fontenc", "inputenc", "textcomp",
+    "lmodern", "luaotfload", "xeCJK", "xeCJKfntef", "luatexja-preset", "luatexja-fontspec",
+    "babel", "polyglossia", "selnolig", "microtype", "sourcesanspro", "sourcecodepro",
+    "sourceserifpro", "hyperref", "bookmark", "xurl", "footnotebackref",
+}
+
+# Template variables that make pandoc load packages only some documents need;
+# the probe render sets them so one format covers every document.
+PROBE_VARIABLES = ["tables=true", "graphics=true"]
+
+_CLASS_RE = re.compile(r"\\documentclass(\[.*?\])?\{[^}]*\}", re.DOTALL)
+_PACKAGE_RE = re.compile(r"^\\usepackage(?:\[[^\]]*\])?\{([^}]*)\}")
+_PASS_OPTIONS_RE = re.compile(r"^\\PassOptionsToPackage\{[^}]*\}\{[^}]*\}")
+
+_lock = threading.Lock()
+_preambles = {}
+
+
+def enabled():
+    """Whether precompiled preamble formats are switched on."""
+    return os.environ.get("MD2PDF_PRECOMPILED_PREAMBLE", "").lower() in ("1", "true", "yes")
+
+
+def format_dir():
+    return Path(os.environ.get("MD2PDF_FORMAT_DIR") or DEFAULT_FORMAT_DIR)
+
+
+def extract_preamble(latex_source):
+    """Reduce a rendered document to the dumpable part of its preamble.
+
+    Keeps the \\documentclass declaration and every top-level \\usepackage and
+    \\PassOptionsToPackage line (in document order) that does not touch fonts.
+    Returns None if the source has no document class.
+    """
+
+    preamble = latex_source.split("\\begin{document}", 1)[0]
+    class_match = _CLASS_RE.search(preamble)
+    if not class_match:
+        return None
+
+    lines = []
+    for line in preamble[:class_match.start()].splitlines():
+        if _PASS_OPTIONS_RE.match(line):
+            lines.append(line.strip())
+    lines.append(class_match.group(0))
+
+    for line in preamble[class_match.end():].splitlines():
+        if _PASS_OPTIONS_RE.match(line):
+            lines.append(line.strip())
+            continue
+        package_match = _PACKAGE_RE.match(line)
+        if not package_match:
+            continue
+        packages = {name.strip() for name in package_match.group(1).split(",")}
+        if packages & EXCLUDED_PACKAGES:
+            continue
+        lines.append(package_match.group(0))
+
+    lines.append("\\begin{document}")
+    lines.append("\\end{document}")
+    return "\n".join(lines) + "\n"
+
+
+def _probe_preamble(pandoc, pandoc_args):
+    """Render the template for an empty document and extract its dumpable preamble."""
+
+    cmd = [pandoc, "-f", "markdown", "-t", "latex", "--standalone"] + list(pandoc_args)
+    for variable in PROBE_VARIABLES:
+        cmd.extend(["-V", variable])
+
+    result = processes.run(cmd, input="")
+    if result.returncode != 0:
+        return None
+    return extract_preamble(result.stdout)
+
+
+def probe_args(pandoc_cmd):
+    """Strip input, output, body, engine and metadata arguments that don't affect the preamble."""
+
+    args = []
+    skip_next = False
+    for arg in pandoc_cmd[2:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in ("-o", "-M", "--include-after-body"):
+            skip_next = True
+            continue
+        if arg.startswith("--pdf-engine"):
+            continue
+        if arg.startswith("titlepage-background="):
+            # Only whether a background is set matters (it pulls in tikz), not the per-run path
+            arg = "titlepage-background=background.png"
+        args.append(arg)
+    return tuple(args)
+
+
+def build_format(preamble, target_dir):
+    """Dump preamble into <target_dir>/<hash>.fmt with mylatexformat.
+
+    Returns the format path without extension (as xelatex -fmt expects), or None if
+    the format could not be built. Failed builds leave a .failed marker so they are
+    not retried on every render.
+    """
+
+    name = "md2pdf-" + hashlib.sha256(preamble.encode("utf-8")).hexdigest()[:16]
+    target_dir = Path(target_dir)
+    fmt_path = target_dir / f"{name}.fmt"
+    failed_path = target_dir / f"{name}.failed"
+
+    if fmt_path.exists():
+        return target_dir / name
+    if failed_path.exists():
+        return None
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory() as build_dir:
+        preamble_path = Path(build_dir) / "preamble.tex"
+        preamble_path.write_text(preamble, encoding="utf-8")
+        try:
+            result = processes.run(
+                [
+                    "xelatex", "-ini", "-interaction=nonstopmode", "-halt-on-error",
+                    f"-jobname={name}", "&xelatex", "mylatexformat.ltx", str(preamble_path),
+                ],
+                cwd=build_dir
+            )
+        except FileNotFoundError:
+            return None
+
+        built = Path(build_dir) / f"{name}.fmt"
+        if result.returncode != 0 or not built.exists():
+            failed_path.write_text(result.stdout[-4000:], encoding="utf-8")
+            return None
+
+        # Move into place atomically so concurrent renders never load a partial format
+        staged = target_dir / f"{name}.fmt.tmp{os.getpid()}"
+        shutil.move(str(built), staged)
+        os.replace(staged, fmt_path)
+
+    return target_dir / name
+
+
+def mark_failed(fmt):
+    """Stop using a format after a render that used it failed."""
+    fmt = Path(fmt)
+    failed_path = fmt.parent / f"{fmt.name}.failed"
+    failed_path.write_text("render failed with this format\n", encoding="utf-8")
+    try:
+        (fmt.parent / f"{fmt.name}.fmt").unlink()
+    except FileNotFoundError:
+        pass
+
+
+def format_for(pandoc_cmd):
+    """Return a precompiled format for this command's preamble, building it on first use.
+
+    Returns None when formats are disabled or unavailable; callers then render normally.
+    """
+
+    if not enabled():
+        return None
+
+    key = probe_args(pandoc_cmd)
+    with _lock:
+        if key not in _preambles:
+            _preambles[key] = _probe_preamble(pandoc_cmd[0], key)
+        preamble = _preambles[key]
+        if preamble is None:
+            return None
+        return build_format(preamble, format_dir())
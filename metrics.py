@@ -0,0 +1,284 @@
+"""Conversion instrumentation: per-stage timings, child resource usage and a Prometheus endpoint.
+
+Each conversion job runs inside trace(); the pipeline marks its steps with
+stage(name). Stages record wall time plus the CPU time and peak RSS of the child
+processes started through processes.run, feed the process-wide registry, and the
+whole trace is logged as one JSON line when the job finishes.
+
+Set MD2PDF_METRICS_PORT to serve the registry at http://<host>:<port>/metrics.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name -> (type, help)
+METRICS = {
+    "md2pdf_stage_seconds": ("histogram", "Wall time of each conversion stage."),
+    "md2pdf_stage_cpu_seconds_total": ("counter", "User+system CPU time of child processes per stage."),
+    "md2pdf_stage_max_rss_bytes": ("gauge", "Largest peak RSS of a child process seen per stage."),
+    "md2pdf_stage_failures_total": ("counter", "Stage failures by cause."),
+    "md2pdf_queue_wait_seconds": ("histogram", "Time jobs spent waiting for a worker."),
+    "md2pdf_job_seconds": ("histogram", "Time from a job starting to it finishing."),
+    "md2pdf_jobs_total": ("counter", "Finished jobs by status."),
+    "md2pdf_cache_hits_total": ("counter", "Cache hits by cache."),
+    "md2pdf_cache_misses_total": ("counter", "Cache misses by cache."),
+    "md2pdf_cache_evictions_total": ("counter", "Cache evictions by cache."),
+    "md2pdf_cache_bytes": ("gauge", "Bytes currently stored per cache."),
+    "md2pdf_cache_entries": ("gauge", "Entries currently stored per cache."),
+    "md2pdf_queue_running": ("gauge", "Jobs currently running."),
+    "md2pdf_queue_pending": ("gauge", "Jobs currently waiting for a worker."),
+    "md2pdf_queue_rejected_total": ("counter", "Jobs rejected because the queue was full."),
+}
+
+logger = logging.getLogger("md2pdf")
+if not logger.handlers:
+    # One JSON object per line on stderr, next to Streamlit's own log output
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get("MD2PDF_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+class Registry:
+    """Thread-safe in-process store of counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+        # callables returning (name, labels, value) samples computed at scrape time
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set_max(self, name, value, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._values[key] = max(self._values.get(key, 0), value)
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            buckets, total, count = self._histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            buckets = [n + (value <= bound) for n, bound in zip(buckets, DURATION_BUCKETS)]
+            self._histograms[key] = (buckets, total + value, count + 1)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            values = dict(self._values)
+            histograms = dict(self._histograms)
+            collectors = list(self._collectors)
+
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    values[(name, _label_key(labels))] = value
+            except Exception:
+                logger.exception("metrics collector failed")
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, n in zip(DURATION_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {n}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+_local = threading.local()
+
+
+@contextmanager
+def trace():
+    """Collect the stages of one job run on the current thread.
+
+    Yields a dict with "stages" (one record per stage) and "fields" (extra facts
+    added with annotate()).
+    """
+
+    record = {"stages": [], "fields": {}}
+    previous = getattr(_local, "trace", None)
+    _local.trace = record
+    try:
+        yield record
+    finally:
+        _local.trace = previous
+
+
+def annotate(**fields):
+    """Attach facts (cache hits, fragment reuse, ...) to the current trace."""
+
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        current["fields"].update(fields)
+
+
+def failure_cause(error):
+    """Short, low-cardinality label for why something failed."""
+    return getattr(error, "cause", None) or type(error).__name__
+
+
+@contextmanager
+def stage(name):
+    """Time one pipeline stage and attribute child process usage to it."""
+
+    record = {"stage": name, "seconds": 0.0, "cpu_seconds": 0.0, "max_rss_bytes": 0}
+    previous = getattr(_local, "stage", None)
+    _local.stage = record
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = failure_cause(e)
+        registry.inc("md2pdf_stage_failures_total", stage=name, cause=record["error"])
+        raise
+    finally:
+        _local.stage = previous
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        registry.observe("md2pdf_stage_seconds", record["seconds"], stage=name)
+        registry.inc("md2pdf_stage_cpu_seconds_total", record["cpu_seconds"], stage=name)
+        registry.set_max("md2pdf_stage_max_rss_bytes", record["max_rss_bytes"], stage=name)
+        current = getattr(_local, "trace", None)
+        if current is not None:
+            current["stages"].append(record)
+
+
+def record_process(rusage):
+    """Add a finished child's resource usage (from os.wait4) to the current stage."""
+
+    current = getattr(_local, "stage", None)
+    if current is None or rusage is None:
+        return
+    current["cpu_seconds"] = round(current["cpu_seconds"] + rusage.ru_utime + rusage.ru_stime, 4)
+    # ru_maxrss is reported in kilobytes on Linux
+    current["max_rss_bytes"] = max(current["max_rss_bytes"], rusage.ru_maxrss * 1024)
+
+
+def job_finished(job, record):
+    """Record queue/job metrics for a finished JobQueue job and log its trace."""
+
+    registry.observe("md2pdf_queue_wait_seconds", job.queue_wait)
+    duration = job.finished_at - job.started_at
+    registry.observe("md2pdf_job_seconds", duration)
+    registry.inc("md2pdf_jobs_total", status=job.status)
+
+    event = {
+        "event": "job_finished",
+        "job_id": job.id,
+        "status": job.status,
+        "queue_wait": round(job.queue_wait, 4),
+        "seconds": round(duration, 4),
+        "stages": record["stages"],
+        **record["fields"],
+    }
+    if job.error is not None:
+        event["cause"] = failure_cause(job.error)
+        event["error"] = str(job.error)
+    logger.info(json.dumps(event, default=str))
+
+
+def cache_samples(name, cache):
+    """Collector samples for a RenderCache."""
+
+    stats = cache.stats()
+    labels = {"cache": name}
+    return [
+        ("md2pdf_cache_hits_total", labels, stats["hits"]),
+        ("md2pdf_cache_misses_total", labels, stats["misses"]),
+        ("md2pdf_cache_evictions_total", labels, stats["evictions"]),
+        ("md2pdf_cache_bytes", labels, stats["bytes"]),
+        ("md2pdf_cache_entries", labels, stats["entries"]),
+    ]
+
+
+def queue_samples(job_queue):
+    """Collector samples for a JobQueue."""
+
+    stats = job_queue.stats()
+    return [
+        ("md2pdf_queue_running", {}, stats["running"]),
+        ("md2pdf_queue_pending", {}, stats["pending"]),
+        ("md2pdf_queue_rejected_total", {}, stats["rejected"]),
+    ]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown out the job log
+        pass
+
+
+def serve(port, host="0.0.0.0"):
+    """Serve /metrics on a daemon thread and return the server."""
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="md2pdf-metrics", daemon=True)
+    thread.start()
+    return server
+
+
+def serve_from_env():
+    """Start the metrics endpoint if MD2PDF_METRICS_PORT is set; returns the server or None."""
+
+    port = os.environ.get("MD2PDF_METRICS_PORT")
+    if not port:
+        return None
+    return serve(int(port), os.environ.get("MD2PDF_METRICS_HOST", "0.0.0.0"))
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import metrics
+
+try:
+    import pikepdf
+except ImportError:  # optional; PDFs are delivered as produced by xelatex without it
+    pikepdf = None
+
+
+def enabled():
+    """Whether rendered PDFs are post-processed (MD2PDF_OPTIMIZE_PDF, default on when pikepdf is installed)."""
+    if pikepdf is None:
+        return False
+    return os.environ.get("MD2PDF_OPTIMIZE_PDF", "1").lower() not in ("0", "false", "no", "off")
+
+
+def _stream_digest(stream):
+    digest = hashlib.sha256(stream.read_raw_bytes())
+    # Filters and decode parameters matter as much as the bytes; /Length follows from them
+    for key, value in sorted(stream.stream_dict.items()):
+        if key != "/Length":
+            digest.update(f"{key}={value!r}".encode("utf-8"))
+    return digest.digest()
+
+
+def _replace_references(container, duplicates):
+    if isinstance(container, pikepdf.Dictionary):
+        items = list(container.items())
+    else:
+        items = list(enumerate(container))
+
+    for key, value in items:
+        if not isinstance(value, pikepdf.Object):
+            # Numbers and booleans come back as plain Python values
+            continue
+        if value.is_indirect:
+            if value.objgen in duplicates:
+                container[key] = duplicates[value.objgen]
+        elif isinstance(value, (pikepdf.Dictionary, pikepdf.Array)):
+            # Direct objects cannot form cycles; only indirect references can
+            _replace_references(value, duplicates)
+
+
+def dedupe_streams(pdf):
+    """Point every reference to a byte-identical stream (images, fonts, forms) at one copy.
+
+    Returns how many duplicates were dropped; qpdf leaves the unreferenced copies out
+    when saving.
+    """
+
+    canonical = {}
+    duplicates = {}
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        try:
+            digest = _stream_digest(obj)
+        except pikepdf.PdfError:
+            continue
+        if digest in canonical:
+            duplicates[obj.objgen] = canonical[digest]
+        else:
+            canonical[digest] = obj
+
+    if not duplicates:
+        return 0
+
+    for obj in pdf.objects:
+        if isinstance(obj, pikepdf.Stream):
+            _replace_references(obj.stream_dict, duplicates)
+        elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Array)):
+            _replace_references(obj, duplicates)
+    return len(duplicates)
+
+
+def optimize_pdf(pdf_path):
+    """Shrink and linearize the PDF at pdf_path in place.
+
+    Deduplicates identical streams, drops unused resources, packs objects into
+    compressed object streams and linearizes the file so viewers can show the
+    first page before the download finishes. The PDF is left untouched if the
+    optimization fails (the error is logged) or the result is larger (tiny documents,
+    where linearization overhead dominates). Returns (size_before, size_after).
+    """
+
+    pdf_path = Path(pdf_path)
+    size_before = pdf_path.stat().st_size
+    optimized_path = pdf_path.with_name(pdf_path.stem + ".optimized.pdf")
+
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            dedupe_streams(pdf)
+            pdf.remove_unreferenced_resources()
+            pdf.save(
+                optimized_path,
+                linearize=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True,
+            )
+    except Exception as e:
+        # Post-processing is best effort (qpdf errors, pikepdf bugs, a full disk); the
+        # PDF as rendered is still valid for viewers
+        metrics.logger.warning(json.dumps(
+            {"event": "optimize_failed", "pdf": pdf_path.name, "error_type": type(e).__name__, "error": str(e)}
+        ))
+        if optimized_path.exists():
+            optimized_path.unlink()
+        return size_before, size_before
+
+    size_after = optimized_path.stat().st_size
+    if size_after > size_before:
+        optimized_path.unlink()
+        return size_before, size_before
+
+    os.replace(optimized_path, pdf_path)
+    return size_before, size_after
@@ -0,0 +1,347 @@
+import io
+import os
+import re
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+import fonts
+
+
+# C0 control characters other than tab, newline and carriage return, and DEL:
+# xelatex stops with "Text line contains an invalid character"
+CONTROL_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+# Code fences at any indentation, also inside blockquotes and after a list marker
+FENCE_RE = re.compile(r"^[ \t>]*(?:(?:[-*+]|\d+[.)])[ \t]+)?(`{3,}|~{3,})")
+# Lines indented like an indented code block; inside a list they are ordinary
+# continuation text, so findings on them are only warnings
+INDENTED_RE = re.compile(r"^(?: {4}|\t)")
+MAYBE_CODE = " (unless it is in an indented code block)"
+INLINE_CODE_RE = re.compile(r"(`+).+?\1")
+# Raw HTML comments; pandoc's LaTeX writer drops them, so nothing in them reaches xelatex
+COMMENT_START = "<!--"
+COMMENT_END = "-->"
+ENVIRONMENT_RE = re.compile(r"(?<!\\)\\(begin|end)\{([^{}]+)\}")
+# Delimiter row of a pipe table, e.g. "|:---|---:|"
+TABLE_DELIMITER_RE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)+\|?\s*$")
+
+# Raw LaTeX commands that cannot work inside the document body -> why
+FATAL_COMMANDS = {
+    "documentclass": "can only be used in the preamble",
+    "usepackage": "can only be used in the preamble",
+    "RequirePackage": "can only be used in the preamble",
+    "input": "reads files that do not exist on the server",
+    "include": "reads files that do not exist on the server",
+    "write18": "runs shell commands, which are disabled",
+    "catcode": "changes how TeX reads the rest of the document",
+}
+FATAL_COMMAND_RE = re.compile(r"(?<!\\)\\(" + "|".join(FATAL_COMMANDS) + r")(?![A-Za-z])")
+
+# Code lines longer than this are not wrapped by the template and run off the page
+CODE_WRAP_WIDTH = 100
+# Minified or base64 lines this long make listings crawl or exhaust TeX's memory
+MAX_CODE_LINE = 1000
+MAX_TABLE_COLUMNS = 12
+# Occurrences reported per kind of problem; the rest are counted
+MAX_REPORTED = 5
+
+
+Issue = namedtuple("Issue", "location message fatal")
+
+
+def enabled():
+    """Whether sources are checked before rendering (MD2PDF_PREFLIGHT, default on)."""
+    return os.environ.get("MD2PDF_PREFLIGHT", "1").lower() not in ("0", "false", "no", "off")
+
+
+def format_issues(issues):
+    return "\n".join(f"{issue.location}: {issue.message}" for issue in issues)
+
+
+def _split_inline_code(line):
+    """Split a line into (is_code, text) parts around inline code spans."""
+
+    parts = []
+    position = 0
+    for match in INLINE_CODE_RE.finditer(line):
+        parts.append((False, line[position:match.start()]))
+        parts.append((True, match.group(0)))
+        position = match.end()
+    parts.append((False, line[position:]))
+    return parts
+
+
+def _split_comments(line, in_comment):
+    """Split a line into (is_comment, text) parts around HTML comments.
+
+    in_comment tells whether the line starts inside a comment; returns (parts,
+    whether the line ends inside one). "<!--" in inline code does not start one.
+    """
+
+    code_spans = [match.span() for match in INLINE_CODE_RE.finditer(line)]
+    parts = []
+    position = 0
+    while position < len(line):
+        if in_comment:
+            end = line.find(COMMENT_END, position)
+            if end < 0:
+                parts.append((True, line[position:]))
+                break
+            end += len(COMMENT_END)
+            parts.append((True, line[position:end]))
+            position = end
+            in_comment = False
+            continue
+
+        start = line.find(COMMENT_START, position)
+        while start >= 0 and any(begin <= start < finish for begin, finish in code_spans):
+            start = line.find(COMMENT_START, start + 1)
+        if start < 0:
+            parts.append((False, line[position:]))
+            break
+        if start > position:
+            parts.append((False, line[position:start]))
+        position = start
+        in_comment = True
+    return parts, in_comment
+
+
+def _wrap(line, width):
+    ending = line[len(line.rstrip("\r\n")):]
+    text = line[:len(line) - len(ending)]
+    return "\n".join(text[i:i + width] for i in range(0, len(text), width)) + ending
+
+
+class Preflight:
+    """Line-by-line checks of the Markdown sources for problems xelatex would fail on.
+
+    Finds raw LaTeX that cannot work in the document body, unbalanced raw
+    environments, control characters, code lines too long for listings, very wide
+    tables and characters the selected fonts have no glyph for. With auto_fix, the
+    problems that have a safe fix are fixed instead of reported: control characters
+    are dropped, long code lines are wrapped and fatal commands are escaped so they
+    print literally.
+
+    Fenced code is recognised at any indentation (list items, blockquotes). Lines
+    indented by four spaces may be an indented code block or list continuation text,
+    so what is found on them is only ever a warning. HTML comments, which pandoc
+    drops from LaTeX output, are not checked.
+    """
+
+    def __init__(self, main_coverage=None, mono_coverage=None, auto_fix=False):
+        self.main_coverage = main_coverage
+        self.mono_coverage = mono_coverage
+        self.auto_fix = auto_fix
+        # (message, fatal) -> [locations]
+        self.problems = {}
+        # character -> first location, for glyphs missing from the main or mono font
+        self.missing_main = {}
+        self.missing_mono = {}
+        self.fixed = 0
+
+    def report(self, location, message, fatal):
+        self.problems.setdefault((message, fatal), []).append(location)
+
+    def check_line(self, line, location, in_code, certain=True):
+        """Check one line; returns the line, fixed when auto_fix is on.
+
+        certain is False for lines that may be code or text (see INDENTED_RE): fatal
+        findings on them are reported as warnings and not auto-fixed.
+        """
+
+        if CONTROL_CHARS_RE.search(line):
+            if self.auto_fix:
+                line = CONTROL_CHARS_RE.sub("", line)
+                self.fixed += 1
+            else:
+                self.report(location, "control character that xelatex cannot typeset", True)
+
+        if not line.isascii():
+            coverage, missing = (self.mono_coverage, self.missing_mono) if in_code else (self.main_coverage, self.missing_main)
+            if coverage is not None:
+                for char in line:
+                    if ord(char) > 127 and not char.isspace() and ord(char) not in coverage and char not in missing:
+                        missing[char] = location
+
+        if in_code:
+            length = len(line.rstrip("\r\n"))
+            if length > CODE_WRAP_WIDTH and self.auto_fix:
+                line = _wrap(line, CODE_WRAP_WIDTH)
+                self.fixed += 1
+            elif length > MAX_CODE_LINE:
+                self.report(location, f"code line longer than {MAX_CODE_LINE} characters", True)
+            elif length > CODE_WRAP_WIDTH:
+                self.report(location, f"code line longer than {CODE_WRAP_WIDTH} characters runs off the page", False)
+            return line
+
+        if TABLE_DELIMITER_RE.match(line):
+            columns = len([cell for cell in line.strip().strip("|").split("|") if cell.strip()])
+            if columns > MAX_TABLE_COLUMNS:
+                self.report(location, f"table with more than {MAX_TABLE_COLUMNS} columns is squeezed to unreadable widths", False)
+
+        if "\\" in line:
+            parts = []
+            for is_code, text in _split_inline_code(line):
+                if not is_code:
+                    fix = self.auto_fix and certain
+                    for command in FATAL_COMMAND_RE.finditer(text):
+                        if not fix:
+                            name = command.group(1)
+                            message = f"raw LaTeX \\{name} {FATAL_COMMANDS[name]}"
+                            self.report(location, message if certain else message + MAYBE_CODE, certain)
+                    if fix and FATAL_COMMAND_RE.search(text):
+                        # An escaped backslash makes Markdown print the command as text
+                        text = FATAL_COMMAND_RE.sub(lambda m: "\\" + m.group(0), text)
+                        self.fixed += 1
+                parts.append(text)
+            line = "".join(parts)
+        return line
+
+    def check_source(self, name, lines, out=None):
+        """Check the lines of one source; fixed lines are written to out when given.
+
+        Raw environments are checked per source because every file is converted to
+        LaTeX on its own.
+        """
+
+        fence = None
+        comment = False
+        # environment name -> line numbers of unclosed \\begin
+        open_environments = {}
+        # Unmatched environments are only fatal if none of them sat on indented lines
+        environments_certain = True
+        mismatched = []
+        for number, line in enumerate(lines, 1):
+            location = f"{name}:{number}"
+            match = None if comment else FENCE_RE.match(line)
+            if match and match.group(1)[0] == "`" and "`" in line[match.end():]:
+                # Inline code such as ```x``` rather than a fence
+                match = None
+            if match:
+                marker = match.group(1)
+                if fence is None:
+                    fence = marker
+                elif marker[0] == fence[0] and len(marker) >= len(fence) and not line[match.end():].strip():
+                    fence = None
+                if out is not None:
+                    out.write(line)
+                continue
+
+            if fence is not None:
+                line = self.check_line(line, location, True)
+                if out is not None:
+                    out.write(line)
+                continue
+
+            # HTML comments are skipped like code, but the text around them is checked
+            parts, comment = _split_comments(line, comment)
+            certain = not INDENTED_RE.match(line)
+            checked = []
+            for is_comment, text in parts:
+                if is_comment or not text:
+                    checked.append(text)
+                    continue
+                text = self.check_line(text, location, False, certain)
+                checked.append(text)
+
+                if "\\" not in text:
+                    continue
+                for is_code, segment in _split_inline_code(text):
+                    if is_code:
+                        continue
+                    for kind, environment in ENVIRONMENT_RE.findall(segment):
+                        environments_certain = environments_certain and certain
+                        if environment == "document":
+                            message = f"raw LaTeX \\{kind}{{document}} would end or restart the document"
+                            self.report(location, message if certain else message + MAYBE_CODE, certain)
+                        elif kind == "begin":
+                            open_environments.setdefault(environment, []).append(number)
+                        elif open_environments.get(environment):
+                            open_environments[environment].pop()
+                        else:
+                            mismatched.append((location, f"raw LaTeX \\end{{{environment}}} without a matching \\begin"))
+            if out is not None:
+                out.write("".join(checked))
+
+        for environment, numbers in open_environments.items():
+            for number in numbers:
+                mismatched.append((f"{name}:{number}", f"raw LaTeX \\begin{{{environment}}} is never closed"))
+        for location, message in mismatched:
+            if environments_certain:
+                self.report(location, message, True)
+            else:
+                self.report(location, message + MAYBE_CODE, False)
+
+    def issues(self, main_font=None, mono_font=None):
+        """All findings as Issue tuples, fatal ones first."""
+
+        issues = []
+        for (message, fatal), locations in self.problems.items():
+            for location in locations[:MAX_REPORTED]:
+                issues.append(Issue(location, message, fatal))
+            if len(locations) > MAX_REPORTED:
+                issues.append(Issue(locations[MAX_REPORTED], f"... {len(locations) - MAX_REPORTED} more of: {message}", fatal))
+
+        for missing, font in ((self.missing_main, main_font), (self.missing_mono, mono_font)):
+            if not missing:
+                continue
+            characters = ", ".join(f"'{char}' (U+{ord(char):04X})" for char in list(missing)[:10])
+            if len(missing) > 10:
+                characters += f" and {len(missing) - 10} more"
+            location = next(iter(missing.values()))
+            issues.append(Issue(location, f"font {font} has no glyph for {characters}; they will be blank in the PDF", False))
+
+        issues.sort(key=lambda issue: not issue.fatal)
+        return issues
+
+
+def _lines(source):
+    if isinstance(source, Path):
+        with open(source, "r", encoding="utf-8") as f:
+            yield from f
+    else:
+        # Not str.splitlines(), which also breaks at form feeds and other separators
+        yield from io.StringIO(source)
+
+
+def check_documents(documents, font_pair=None, auto_fix=False, work_dir=None):
+    """Run the preflight checks over (filename, content) pairs.
+
+    font_pair is the (main font, mono font) the document is typeset with, or None
+    for the template default (glyph coverage is then not checked). Returns
+    (documents, issues): documents with auto-fixes applied (fixed file sources are
+    written to work_dir) and the Issue tuples found.
+    """
+
+    registry = fonts.get_registry()
+    main_font, mono_font = font_pair or (None, None)
+    preflight = Preflight(
+        main_coverage=registry.coverage(main_font) if main_font else None,
+        mono_coverage=registry.coverage(mono_font) if mono_font else None,
+        auto_fix=auto_fix,
+    )
+
+    checked = []
+    for filename, content in documents:
+        if not auto_fix:
+            preflight.check_source(filename, _lines(content))
+            checked.append((filename, content))
+            continue
+
+        fixed_before = preflight.fixed
+        if isinstance(content, Path):
+            # Stream the fixed copy to disk; it replaces the source only if something changed
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=work_dir, suffix=".md", delete=False) as out:
+                preflight.check_source(filename, _lines(content), out)
+            if preflight.fixed > fixed_before:
+                content = Path(out.name)
+            else:
+                os.unlink(out.name)
+        else:
+            out = io.StringIO()
+            preflight.check_source(filename, _lines(content), out)
+            if preflight.fixed > fixed_before:
+                content = out.getvalue()
+        checked.append((filename, content))
+
+    return checked, preflight.issues(main_font, mono_font)
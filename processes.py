@@ -0,0 +1,329 @@
+import errno
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # not available on Windows; processes then run without rlimits
+    resource = None
+
+
+# Budget of one job (a conversion); the CPU seconds are drawn down by every process
+# it starts (see JobScope)
+DEFAULT_JOB_TIMEOUT = 300
+DEFAULT_JOB_CPU_SECONDS = 240
+# Address-space ceiling per process
+DEFAULT_MEMORY_MB = 1024
+
+POSIX = os.name == "posix"
+# util-linux prlimit(1) sets the limits on itself and then execs the command, so
+# they are in place before the command starts
+PRLIMIT = shutil.which("prlimit") if POSIX else None
+# RLIMIT_CPU counts whole seconds, so usage this close to the budget means it is spent
+CPU_SLACK = 0.5
+
+
+class LimitExceeded(RuntimeError):
+    """Raised when a process was stopped for running out of time or CPU.
+
+    cause is "timeout" or "cpu_limit", for metrics and logs.
+    """
+
+    def __init__(self, message, cause):
+        super().__init__(message)
+        self.cause = cause
+
+
+class Cancelled(RuntimeError):
+    """Raised when the job a process belonged to was cancelled."""
+
+    cause = "cancelled"
+
+
+def _env_number(name, default):
+    value = float(os.environ.get(name, default))
+    # 0 disables the limit
+    return value if value > 0 else None
+
+
+class JobScope:
+    """Limits and cancellation shared by the processes of one job.
+
+    The wall-clock deadline starts when the scope is entered (see within) and covers
+    every process of the job. RLIMIT_CPU is per process, so the CPU budget is enforced
+    per process: each one may use what is left of the budget when it starts, and the
+    budget shrinks by what it used (with its reaped children) once it finishes.
+    Processes running at the same time (pandoc and the xelatex under it, parallel
+    shards) can together use more than the budget; the deadline still bounds them.
+    cancel() kills the running processes, from any thread.
+    Settings come from MD2PDF_JOB_TIMEOUT and MD2PDF_JOB_CPU_SECONDS (seconds) and
+    MD2PDF_PROCESS_MEMORY_MB; 0 turns a limit off.
+    """
+
+    def __init__(self, timeout=None, cpu_seconds=None, memory_bytes=None):
+        if timeout is None:
+            timeout = _env_number("MD2PDF_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
+        if cpu_seconds is None:
+            cpu_seconds = _env_number("MD2PDF_JOB_CPU_SECONDS", DEFAULT_JOB_CPU_SECONDS)
+        if memory_bytes is None:
+            memory_mb = _env_number("MD2PDF_PROCESS_MEMORY_MB", DEFAULT_MEMORY_MB)
+            memory_bytes = int(memory_mb * 1024 * 1024) if memory_mb else None
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.cpu_left = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.deadline = None
+        self.cancelled = False
+
+        self._lock = threading.Lock()
+        # Running processes that have not been reaped yet
+        self._running = set()
+        # Processes killed for the deadline
+        self._expired = set()
+
+    def start(self):
+        """Start the wall clock; only the first call counts."""
+        if self.deadline is None and self.timeout is not None:
+            self.deadline = time.monotonic() + self.timeout
+
+    def time_left(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def cancel(self):
+        """Stop the job: kill its running processes and refuse to start new ones."""
+        with self._lock:
+            self.cancelled = True
+            for process in self._running:
+                _kill_group(process)
+
+    def _command(self, cmd):
+        """cmd prefixed with prlimit(1) to run under the CPU and memory limits.
+
+        Returns (command, limited); without prlimit the command is returned as it is
+        and _started applies the CPU limit after the fact.
+        """
+
+        limits = _limit_values(self.cpu_left, self.memory_bytes)
+        if PRLIMIT is None or not limits:
+            return cmd, False
+        options = [f"--{name}={soft}:{hard}" for name, (soft, hard) in limits.items()]
+        return [PRLIMIT] + options + ["--"] + list(cmd), True
+
+    def _started(self, process, limited):
+        with self._lock:
+            if self.cancelled:
+                _kill_group(process)
+            self._running.add(process)
+        if not limited:
+            _apply_cpu_limit(process.pid, self.cpu_left)
+
+    def _expire(self, process):
+        with self._lock:
+            if process in self._running:
+                self._expired.add(process)
+                _kill_group(process)
+
+    def _used(self, cpu_seconds):
+        """Charge a finished process to the CPU budget; returns the budget it ran with."""
+        with self._lock:
+            limit = self.cpu_left
+            if limit is not None:
+                self.cpu_left = limit - cpu_seconds
+            return limit
+
+    def _exited(self, process):
+        # Called before the process is reaped, so its group id cannot have been reused
+        with self._lock:
+            self._running.discard(process)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def within(scope):
+    """Run the processes started by this thread under scope (a JobScope, or None)."""
+
+    previous = getattr(_local, "scope", None)
+    if scope is not None:
+        scope.start()
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = previous
+
+
+def current():
+    """The JobScope of this thread, or None; hand it to worker threads with within()."""
+    return getattr(_local, "scope", None)
+
+
+def _kill_group(process):
+    try:
+        if POSIX:
+            # pandoc starts xelatex in the same group, so one signal stops both
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _limit_values(cpu_seconds, memory_bytes):
+    """prlimit resource name -> (soft, hard), within the hard limits of this process."""
+
+    limits = {}
+    if cpu_seconds is not None:
+        # The soft limit sends SIGXCPU; the hard limit a second later kills
+        seconds = max(1, int(cpu_seconds + 0.5))
+        limits["cpu"] = (seconds, seconds + 1)
+    if memory_bytes is not None:
+        # An address-space cap: the GHC runtime of pandoc sizes its heap reservation
+        # to fit when the cap is in place at start-up, and xelatex fails with an
+        # out-of-memory error. Set after start-up it would sit below what pandoc
+        # already reserved and make its later allocations fail.
+        limits["as"] = (memory_bytes, memory_bytes)
+
+    if resource is not None:
+        # A child cannot raise a hard limit it inherited
+        current = {"cpu": resource.RLIMIT_CPU, "as": resource.RLIMIT_AS}
+        for name, (soft, hard) in list(limits.items()):
+            inherited = resource.getrlimit(current[name])[1]
+            if inherited != resource.RLIM_INFINITY:
+                limits[name] = (min(soft, inherited), min(hard, inherited))
+    return limits
+
+
+def _apply_cpu_limit(pid, cpu_seconds):
+    # Fallback without prlimit(1): set RLIMIT_CPU on the running process (safe after
+    # exec, unlike an address-space cap, and unlike a preexec_fn safe in a threaded
+    # server). Processes the child starts later inherit it.
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    limit = _limit_values(cpu_seconds, None).get("cpu")
+    if limit is None:
+        return
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, limit)
+    except (ProcessLookupError, PermissionError, ValueError):
+        pass
+
+
+def _executable(program, cwd):
+    if os.sep in program:
+        # Relative paths are resolved in the directory the process will run in
+        path = os.path.join(cwd or os.getcwd(), program)
+        return os.path.isfile(path) and os.access(path, os.X_OK)
+    return shutil.which(program) is not None
+
+
+def _wait_exited(process):
+    # Wait without reaping, so the process group still exists while the scope
+    # forgets the process and no late kill can reach a reused group id
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+
+
+def run(cmd, input=None, cwd=None):
+    """Run cmd to completion, like subprocess.run(cmd, capture_output=True, text=True).
+
+    Output is spooled to temporary files rather than held in pipes, and the child
+    is reaped with os.wait4 so the result also carries its resource usage:
+    result.rusage (None where wait4 is unavailable) and result.elapsed in seconds.
+    The usage is added to the current metrics stage.
+
+    The process runs in its own process group under the limits of the current
+    JobScope (see within), or of a fresh one when called outside a job. Raises
+    LimitExceeded when the group was killed for the deadline or the CPU budget and
+    Cancelled when the job was cancelled.
+    """
+
+    scope = current() or JobScope()
+    scope.start()
+    if scope.cancelled:
+        raise Cancelled("The conversion was cancelled")
+    timeout = scope.time_left()
+    if timeout is not None and timeout <= 0:
+        raise LimitExceeded(f"The conversion ran longer than {scope.timeout:g} seconds", "timeout")
+    if scope.cpu_left is not None and scope.cpu_left < CPU_SLACK:
+        raise LimitExceeded(f"The conversion used more than {scope.cpu_seconds:g} seconds of CPU time", "cpu_limit")
+
+    launch, limited = scope._command(cmd)
+    if limited and not _executable(cmd[0], cwd):
+        # prlimit would report the missing executable as a failed run
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", cmd[0])
+
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            launch, cwd=cwd, stdout=out, stderr=err,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            start_new_session=POSIX
+        )
+        scope._started(process, limited)
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, scope._expire, (process,))
+            timer.daemon = True
+            timer.start()
+
+        try:
+            if input is not None:
+                try:
+                    process.stdin.write(input.encode("utf-8"))
+                except BrokenPipeError:
+                    # The child exited without reading everything; its exit code tells why
+                    pass
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+            _wait_exited(process)
+        finally:
+            scope._exited(process)
+            if timer is not None:
+                timer.cancel()
+
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            rusage = None
+            process.wait()
+        elapsed = time.perf_counter() - started
+
+        out.seek(0)
+        err.seek(0)
+        result = subprocess.CompletedProcess(
+            cmd, process.returncode,
+            out.read().decode("utf-8", "replace"), err.read().decode("utf-8", "replace")
+        )
+
+    result.rusage = rusage
+    result.elapsed = elapsed
+    metrics.record_process(rusage)
+
+    cpu_seconds = rusage.ru_utime + rusage.ru_stime if rusage is not None else 0.0
+    limit = scope._used(cpu_seconds)
+
+    if scope.cancelled:
+        raise Cancelled("The conversion was cancelled")
+    if process in scope._expired:
+        raise LimitExceeded(f"The conversion ran longer than {scope.timeout:g} seconds", "timeout")
+    if limit is not None and cpu_seconds >= limit - CPU_SLACK and result.returncode != 0:
+        # RLIMIT_CPU stopped the process (or xelatex under pandoc)
+        raise LimitExceeded(f"The conversion used more than {scope.cpu_seconds:g} seconds of CPU time", "cpu_limit")
+    return result
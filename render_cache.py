@@ -0,0 +1,218 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+DEFAULT_CACHE_ROOT = Path(tempfile.gettempdir()) / "md2pdf-cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def render_key(source, pandoc_args, template, background_bytes=None):
+    """Build a content-addressed key for one render from everything that affects the PDF."""
+
+    digest = hashlib.sha256()
+
+    # Length-prefix every part so that adjacent fields can never collide
+    def update(part):
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+
+    update(source)
+    update("\0".join(pandoc_args))
+    update(template)
+    update(background_bytes or b"")
+
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Persistent on-disk cache of render artifacts with size-bounded LRU eviction.
+
+    kind names the subdirectory of the cache root ("renders" for PDFs, "fragments" for
+    per-file LaTeX); suffix is the file extension of the stored entries. With an empty
+    suffix the keys carry their own extension (e.g. images).
+
+    Entries used within the last keep_seconds are never evicted, for callers that
+    hand out paths into the cache (get_path, put_file) and read them later; the cache
+    may then exceed max_bytes for a while.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, kind="renders", suffix=".pdf", keep_seconds=0):
+        if cache_dir is None:
+            cache_dir = Path(os.environ.get("MD2PDF_CACHE_DIR") or DEFAULT_CACHE_ROOT) / kind
+        self.cache_dir = Path(cache_dir)
+        self.suffix = suffix
+        if max_bytes is None:
+            max_mb = os.environ.get("MD2PDF_CACHE_MAX_MB")
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES
+        self.max_bytes = max_bytes
+        self.keep_seconds = keep_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path_for(self, key):
+        return self.cache_dir / f"{key}{self.suffix}"
+
+    def _entries(self):
+        # Temporary files of in-progress writes are hidden
+        return [entry for entry in self.cache_dir.glob(f"*{self.suffix}") if not entry.name.startswith(".")]
+
+    def get_path(self, key):
+        """Return the path of the cached entry for key, or None on a miss.
+
+        The entry is marked as recently used; callers read it directly from disk.
+        """
+
+        path = self._path_for(key)
+        with self._lock:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            except OSError:
+                pass
+
+            self.hits += 1
+            return path
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+
+        path = self._path_for(key)
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+
+            # Touch the entry so eviction treats it as most recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+            self.hits += 1
+            return data
+
+    def copy_to(self, key, dest_path):
+        """Copy the cached entry for key to dest_path without reading it into memory.
+
+        Returns False on a miss.
+        """
+
+        path = self._path_for(key)
+        with self._lock:
+            try:
+                shutil.copyfile(path, dest_path)
+            except FileNotFoundError:
+                self.misses += 1
+                return False
+
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+            self.hits += 1
+            return True
+
+    def put(self, key, data):
+        """Store bytes under key and evict least recently used entries if over budget."""
+
+        if len(data) > self.max_bytes:
+            # Never let a single oversized render flush the whole cache
+            return
+
+        self._store(key, lambda f: f.write(data))
+
+    def put_file(self, key, src_path):
+        """Store a copy of the file at src_path under key, streaming it in chunks.
+
+        Returns the path of the stored entry, or None if the file is too large to cache.
+        """
+
+        if os.path.getsize(src_path) > self.max_bytes:
+            return None
+
+        def write(f):
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+
+        self._store(key, write)
+        return self._path_for(key)
+
+    def _store(self, key, write):
+        path = self._path_for(key)
+        with self._lock:
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total += stat.st_size
+
+        # Oldest access time first
+        entries.sort(key=lambda item: item[0])
+        protected_since = time.time() - self.keep_seconds
+        for mtime, size, entry in entries:
+            if total <= self.max_bytes or (self.keep_seconds and mtime >= protected_since):
+                # Everything after this entry was used even more recently
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and current disk usage."""
+
+        with self._lock:
+            entries = self._entries()
+            size = 0
+            for entry in entries:
+                try:
+                    size += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,32 @@
+"""Start the MD2PDF server:
+
+    python serve.py [streamlit options, e.g. --server.port=8501]
+
+Runs the warmup (see warmup.py), starts the HTTP API and metrics endpoints and then
+runs Streamlit with app.py in this same process. The processed templates, font
+registry and highlighting macros warmed up here stay in memory for every session,
+and the servers share the queue and caches of the page (see services.py).
+"""
+
+import os
+import sys
+
+from streamlit.web import cli as stcli
+
+import services
+import warmup
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    warmup.main()
+    services.start_servers()
+    sys.argv = ["streamlit", "run", APP_PATH] + list(argv)
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
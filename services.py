@@ -0,0 +1,94 @@
+"""Process-wide services of the MD2PDF server: caches, artifact store, job queue and
+the API and metrics endpoints.
+
+Everything is created once per process and shared by every Streamlit session, the
+HTTP API and the metrics collector, so the worker limit and the caches cover all of
+them. serve.py starts the servers before Streamlit serves its first page.
+"""
+
+import threading
+
+import api
+import images
+import metrics
+from artifacts import ArtifactStore
+from job_queue import JobQueue
+from render_cache import RenderCache
+
+
+_lock = threading.RLock()
+_instances = {}
+_servers = None
+
+
+def _shared(name, factory):
+    with _lock:
+        if name not in _instances:
+            _instances[name] = factory()
+        return _instances[name]
+
+
+def render_cache():
+    """Render cache of finished PDFs."""
+    return _shared("render_cache", RenderCache)
+
+
+def fragment_cache():
+    """Cache of per-file LaTeX fragments."""
+    return _shared("fragment_cache", lambda: RenderCache(kind="fragments", suffix=".tex"))
+
+
+def preview_cache():
+    """Cache of rendered HTML previews."""
+    return _shared("preview_cache", lambda: RenderCache(kind="previews", suffix=".html"))
+
+
+def image_cache():
+    """Cache of downscaled images from uploaded bundles."""
+    return _shared("image_cache", images.create_cache)
+
+
+def artifact_store():
+    """On-disk store of generated PDFs."""
+    return _shared("artifact_store", ArtifactStore)
+
+
+def job_queue():
+    """Queue that bounds how many conversions run at once."""
+    return _shared("job_queue", JobQueue)
+
+
+def start_servers():
+    """Start the metrics endpoint (MD2PDF_METRICS_PORT) and the HTTP API
+    (MD2PDF_API_PORT) when configured; only the first call starts anything.
+
+    Returns (metrics server, API server), each None when its port is not set.
+    """
+
+    global _servers
+    with _lock:
+        if _servers is not None:
+            return _servers
+
+        caches = {
+            "renders": render_cache(),
+            "fragments": fragment_cache(),
+            "previews": preview_cache(),
+            "images": image_cache(),
+        }
+        queue = job_queue()
+        metrics.registry.add_collector(
+            lambda: [sample for name, cache in caches.items() for sample in metrics.cache_samples(name, cache)]
+            + metrics.queue_samples(queue)
+        )
+        _servers = (
+            metrics.serve_from_env(),
+            api.serve_from_env(
+                job_queue=queue,
+                artifact_store=artifact_store(),
+                render_cache=render_cache(),
+                fragment_cache=fragment_cache(),
+                image_cache=image_cache(),
+            ),
+        )
+        return _servers
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Stand-in for pandoc that needs no TeX, for tests (set converter.PANDOC to it).
+
+Concatenates its Markdown inputs (or stdin) and writes them to -o behind a PDF
+header, or to stdout. Enough for the pipeline to run end to end. When
+STUB_PANDOC_LOG is set, every command line is appended to that file as a JSON line.
+"""
+
+import json
+import os
+import sys
+
+
+def main(args):
+    log_path = os.environ.get("STUB_PANDOC_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(json.dumps(args) + "\n")
+
+    if "--version" in args:
+        print("pandoc 3.1.11")
+        return 0
+
+    output = args[args.index("-o") + 1] if "-o" in args else None
+    inputs = [arg for arg in args if arg.endswith(".md")]
+    if inputs:
+        text = ""
+        for path in inputs:
+            with open(path, "r", encoding="utf-8") as f:
+                text += f.read()
+    else:
+        text = sys.stdin.read()
+
+    if "--include-after-body" in args:
+        with open(args[args.index("--include-after-body") + 1], "r", encoding="utf-8") as f:
+            text += f.read()
+    if "--template" in args and output is None:
+        with open(args[args.index("--template") + 1], "r", encoding="utf-8") as f:
+            if "$highlighting-macros$" in f.read():
+                # The highlighting macros probe (converter.highlighting_macros)
+                text = "\\newcommand{\\KeywordTok}[1]{#1}\n"
+
+    if output:
+        with open(output, "wb") as f:
+            f.write(b"%PDF-1.4\n% stub\n" + text.encode("utf-8"))
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
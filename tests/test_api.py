@@ -0,0 +1,112 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import pytest
+
+import api
+import converter
+from artifacts import ArtifactStore
+from job_queue import JobQueue
+
+
+STUB_PANDOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_pandoc.py")
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(converter, "PANDOC", STUB_PANDOC)
+    monkeypatch.setenv("MD2PDF_OPTIMIZE_PDF", "0")
+    monkeypatch.setenv("MD2PDF_PRECOMPILED_PREAMBLE", "0")
+    monkeypatch.delenv("MD2PDF_API_TOKEN", raising=False)
+    server = api.serve(
+        0, "127.0.0.1",
+        job_queue=JobQueue(workers=1, max_pending=4),
+        artifact_store=ArtifactStore(root=tmp_path / "artifacts"),
+    )
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _multipart(files, fields):
+    boundary = uuid.uuid4().hex
+    body = b""
+    for name, value in fields.items():
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        ).encode("utf-8")
+    for filename, content in files:
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: text/markdown\r\n\r\n"
+        ).encode("utf-8") + content + b"\r\n"
+    body += f"--{boundary}--\r\n".encode("utf-8")
+    return f"multipart/form-data; boundary={boundary}", body
+
+
+def _request(url, data=None, content_type=None, method=None):
+    request = urllib.request.Request(url, data=data, method=method)
+    if content_type:
+        request.add_header("Content-Type", content_type)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def test_submit_poll_and_download(server):
+    content_type, body = _multipart(
+        [("intro.md", b"# Intro\n\nHello.\n"), ("body.md", b"# Body\n\n```python\nx = 1\n```\n")],
+        {"title": "Report", "toc": "true"},
+    )
+    status, headers, payload = _request(f"{server}/jobs", body, content_type)
+    assert status == 202
+    job_id = json.loads(payload)["id"]
+    assert headers["Location"] == f"/jobs/{job_id}"
+
+    deadline = time.monotonic() + 30
+    while True:
+        status, _, payload = _request(f"{server}/jobs/{job_id}")
+        assert status == 200
+        job = json.loads(payload)
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            break
+        time.sleep(0.1)
+    assert job["status"] == "done", job
+    assert job["pdf_url"] == f"/jobs/{job_id}/pdf"
+
+    status, headers, pdf = _request(f"{server}{job['pdf_url']}")
+    assert status == 200
+    assert headers["Content-Type"] == "application/pdf"
+    assert pdf.startswith(b"%PDF")
+    # Both files made it through the merge, in order
+    assert pdf.index(b"Hello.") < pdf.index(b"x = 1")
+
+
+def test_upload_without_files_is_rejected(server):
+    content_type, body = _multipart([], {"title": "Report"})
+    status, _, payload = _request(f"{server}/jobs", body, content_type)
+    assert status == 400
+    assert "files" in json.loads(payload)["error"]
+
+
+def test_unknown_option_is_rejected(server):
+    content_type, body = _multipart([("a.md", b"# A\n")], {"no_such_option": "1"})
+    status, _, _ = _request(f"{server}/jobs", body, content_type)
+    assert status == 400
+
+
+def test_truncated_body_is_rejected(server):
+    content_type, body = _multipart([("a.md", b"# A\n")], {})
+    status, _, _ = _request(f"{server}/jobs", body[:-20], content_type)
+    assert status == 400
+
+
+def test_unknown_job_is_not_found(server):
+    status, _, _ = _request(f"{server}/jobs/{uuid.uuid4().hex}")
+    assert status == 404
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+import converter
+import images
+from converter import PdfOptions
+
+
+STUB_PANDOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_pandoc.py")
+
+
+@pytest.fixture
+def pandoc_log(tmp_path, monkeypatch):
+    """Run conversions against the stub pandoc; returns a function reading its command lines."""
+
+    log_path = tmp_path / "pandoc.log"
+    monkeypatch.setattr(converter, "PANDOC", STUB_PANDOC)
+    monkeypatch.setenv("STUB_PANDOC_LOG", str(log_path))
+    monkeypatch.setenv("MD2PDF_OPTIMIZE_PDF", "0")
+    monkeypatch.setenv("MD2PDF_PRECOMPILED_PREAMBLE", "0")
+
+    def commands():
+        with open(log_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+    return commands
+
+
+def _render_command(commands):
+    return next(args for args in commands if "--pdf-engine=xelatex" in args)
+
+
+@pytest.mark.parametrize("target, includable", [
+    ("figure.png", True),
+    ("/tmp/bundle/Figure.JPG", True),
+    ("diagram.pdf", True),
+    ("figure", True),
+    ("https://example.com/x.png", False),
+    ("data:image/png;base64,AAAA", False),
+    ("diagram.svg", False),
+    ("anim.gif", False),
+    ("photo.webp?raw=1", False),
+])
+def test_xelatex_can_include(target, includable):
+    assert images.xelatex_can_include(target) is includable
+
+
+@pytest.mark.parametrize("markdown", [
+    "Text\n\n![Chart](https://example.com/chart.png)\n",
+    "![Diagram](<diagrams/flow.svg> \"Flow\")\n",
+    "![Logo][logo]\n\n[logo]: https://example.com/logo.png\n",
+    "![logo]\n\n[Logo]: images/logo.webp\n",
+])
+def test_foreign_images_are_detected(markdown):
+    assert converter.needs_pandoc_images(markdown)
+
+
+@pytest.mark.parametrize("markdown", [
+    "![Figure](figure.png)\n",
+    "A [link](https://example.com/page.svg) is not an image.\n",
+    "![Logo][logo]\n\n[logo]: logo.pdf\n[site]: https://example.com\n",
+])
+def test_includable_images_are_not_flagged(markdown):
+    assert not converter.needs_pandoc_images(markdown)
+
+
+def test_detection_reads_files(tmp_path):
+    source = tmp_path / "doc.md"
+    source.write_text("![x](https://example.com/x.png)\n", encoding="utf-8")
+    assert converter.needs_pandoc_images(source)
+
+
+@pytest.mark.parametrize("image", ["https://example.com/chart.png", "diagram.svg"])
+def test_foreign_images_render_from_merged_markdown(pandoc_log, image):
+    documents = [("intro.md", "# Intro\n\nHello.\n"), ("body.md", f"![Chart]({image})\n")]
+    result = converter.convert(documents, PdfOptions(parallel_chapters=True))
+
+    render = _render_command(pandoc_log())
+    assert "--include-after-body" not in render
+    assert render[0].endswith("merged.md")
+    # The image reaches pandoc as written, for it to fetch or convert
+    assert image.encode("utf-8") in result.pdf_bytes
+    assert result.fragments_total == 0
+
+
+def test_plain_documents_render_from_fragments(pandoc_log):
+    documents = [("intro.md", "# Intro\n\nHello.\n"), ("body.md", "![Figure](figure.png)\n")]
+    result = converter.convert(documents, PdfOptions())
+
+    render = _render_command(pandoc_log())
+    assert "--include-after-body" in render
+    assert result.fragments_total == 4
+    assert b"Hello." in result.pdf_bytes
+
+
+SHARD_AUX = r"""\relax
+\@writefile{toc}{\contentsline {section}{intro}{1}{section*.1}\protected@file@percent }
+\newlabel{md2pdf-chapter-0}{{}{1}{intro}{section*.1}{}}
+\@writefile{toc}{\contentsline {subsection}{\numberline {1.1}Setup \texttt {a\{b}}{2}{subsection.1.1}\protected@file@percent }
+\@writefile{toc}{\contentsline {paragraph}{Too deep}{2}{paragraph*.3}\protected@file@percent }
+\@writefile{toc}{\contentsline {subsubsection}{Details, more}{3}{subsubsection*.4}\protected@file@percent }
+"""
+
+
+def test_toc_entries_are_read_from_the_aux_file():
+    assert converter.toc_entries(SHARD_AUX) == [
+        ("section", "intro", 1),
+        ("subsection", "Setup \\texttt {a\\{b}", 2),
+        ("subsubsection", "Details, more", 3),
+    ]
+
+
+def test_stitched_toc_keeps_the_headings_inside_files(tmp_path, monkeypatch):
+    def render_shard(shard_cmd, tex_path, chapter_count):
+        entries = converter.toc_entries(SHARD_AUX) if tex_path.parent.name == "shard-000" else []
+        return tex_path.with_suffix(".pdf"), [1] * chapter_count, entries, []
+
+    stitched = {}
+
+    def run_pandoc(cmd):
+        body_path = cmd[cmd.index("--include-after-body") + 1]
+        with open(body_path, "r", encoding="utf-8") as f:
+            stitched["body"] = f.read()
+        return converter.processes.subprocess.CompletedProcess(cmd, 0, "", "")
+
+    monkeypatch.setattr(converter, "_render_shard", render_shard)
+    monkeypatch.setattr(converter, "_run_pandoc", run_pandoc)
+    chapters = [("intro", "\\section{intro}\n", "Text\n"), ("body", "\\section{body}\n", "Text\n")]
+    converter.render_sharded(chapters, PdfOptions(), str(tmp_path), tmp_path / "out.pdf", 2)
+
+    first, second = stitched["body"].splitlines()
+    assert "1,section,1,{intro},md2pdf-shard-0-0" in first
+    assert "2,subsection,2,{Setup \\texttt {a\\{b}},md2pdf-shard-0-1" in first
+    assert "3,subsubsection,3,{Details, more},md2pdf-shard-0-2" in first
+    assert "Too deep" not in first
+    # Without entries in the .aux, each file still gets one
+    assert "1,section,1,{body},md2pdf-shard-1-0" in second
@@ -0,0 +1,153 @@
+from pathlib import Path
+
+import pytest
+
+import converter
+import preflight
+from converter import ConversionError, PdfOptions
+from preflight import Preflight
+
+
+def _issues(markdown):
+    checker = Preflight()
+    checker.check_source("doc.md", markdown.splitlines(True))
+    return checker.issues()
+
+
+def _fatal(markdown):
+    return [issue for issue in _issues(markdown) if issue.fatal]
+
+
+def _warnings(markdown):
+    return [issue for issue in _issues(markdown) if not issue.fatal]
+
+
+def test_raw_input_in_text_is_fatal():
+    issues = _fatal("Intro\n\n\\input{chapter}\n")
+    assert [issue.location for issue in issues] == ["doc.md:3"]
+    assert "\\input" in issues[0].message
+
+
+@pytest.mark.parametrize("markdown", [
+    "```\n\\input{x}\n```\n",
+    "~~~~ latex\n\\usepackage{x}\n~~~~\n",
+    "  ```\n\\input{x}\n  ```\n",
+    "- item\n\n    ```\n    \\input{x}\n    ```\n",
+    "1. step\n   ```tex\n   \\documentclass{article}\n   ```\n",
+    "> quoted\n> ```\n> \\input{x}\n> ```\n",
+    "> - nested\n>   ```\n>   \\begin{document}\n>   ```\n",
+])
+def test_fenced_code_is_not_checked_as_latex(markdown):
+    assert _fatal(markdown) == []
+
+
+def test_longer_fence_is_not_closed_by_a_shorter_one():
+    assert _fatal("````\n```\n\\input{x}\n````\nText\n") == []
+
+
+def test_fence_closes_and_checking_resumes():
+    issues = _fatal("```\ncode\n```\n\\input{x}\n")
+    assert [issue.location for issue in issues] == ["doc.md:4"]
+
+
+@pytest.mark.parametrize("markdown", [
+    "Use `\\input{file}` to include a file.\n",
+    "Write ``\\usepackage{x}`` in the preamble.\n",
+    "Inline ```\\input{x}``` code\n",
+])
+def test_inline_code_is_not_checked_as_latex(markdown):
+    assert _issues(markdown) == []
+
+
+def test_indented_lines_only_warn():
+    assert _fatal("Text\n\n    \\input{x}\n") == []
+    warnings = _warnings("Text\n\n    \\input{x}\n")
+    assert len(warnings) == 1
+    assert warnings[0].message.endswith(preflight.MAYBE_CODE)
+
+
+def test_balanced_environments_pass():
+    assert _issues("\\begin{center}\nText\n\\end{center}\n") == []
+
+
+def test_unclosed_environment_is_fatal():
+    issues = _fatal("\\begin{center}\nText\n")
+    assert [(issue.location, issue.message) for issue in issues] == [
+        ("doc.md:1", "raw LaTeX \\begin{center} is never closed")
+    ]
+
+
+def test_stray_end_is_fatal():
+    issues = _fatal("Text\n\\end{itemize}\n")
+    assert [issue.location for issue in issues] == ["doc.md:2"]
+
+
+def test_unbalanced_environment_on_indented_lines_only_warns():
+    issues = _issues("Text\n\n    \\begin{center}\n")
+    assert issues and not any(issue.fatal for issue in issues)
+
+
+def test_document_environment_is_fatal():
+    assert _fatal("\\begin{document}\n")
+
+
+@pytest.mark.parametrize("markdown", [
+    "<!-- \\input{x} -->\nText\n",
+    "<!-- \\usepackage{foo} -->\n",
+    "<!--\n\\usepackage{foo}\n\\begin{document}\n\\input{x}\n-->\nText\n",
+    "Before <!-- \\input{x} --> after\n",
+    "<!-- ```\n-->\n\\begin{center}\n\\end{center}\n",
+])
+def test_html_comments_are_not_checked(markdown):
+    assert _issues(markdown) == []
+
+
+def test_text_around_a_comment_is_checked():
+    issues = _fatal("\\input{a} <!-- note --> \\input{b}\n<!--\n-->\n\\input{c}\n")
+    assert [issue.location for issue in issues] == ["doc.md:1", "doc.md:1", "doc.md:4"]
+
+
+def test_comment_marker_in_inline_code_is_not_a_comment():
+    assert _fatal("`<!--` \\input{x}\n")
+
+
+def test_html_comment_passes_check_sources():
+    documents = [("doc.md", "# Title\n\n<!-- \\input{x} -->\n<!-- \\usepackage{foo} -->\n")]
+    checked, warnings = converter.check_sources(documents, PdfOptions())
+    assert warnings == []
+
+
+def test_check_sources_rejects_fatal_problems():
+    with pytest.raises(ConversionError) as raised:
+        converter.check_sources([("doc.md", "\\input{x}\n")], PdfOptions())
+    assert raised.value.cause == "preflight_failed"
+
+
+def test_auto_fix_text_source():
+    source = "Bad\x01char\n\\input{x}\n<!-- \\input{y} -->\n```\n" + "x" * 150 + "\n```\n    \\input{z}\n"
+    (name, fixed), = preflight.check_documents([("doc.md", source)], auto_fix=True)[0]
+    assert name == "doc.md"
+    lines = fixed.splitlines()
+    assert lines[0] == "Badchar"
+    # An escaped backslash makes Markdown print the command
+    assert lines[1] == "\\\\input{x}"
+    # Comments and uncertain (indented) lines are left alone
+    assert lines[2] == "<!-- \\input{y} -->"
+    assert lines[4] == "x" * preflight.CODE_WRAP_WIDTH
+    assert lines[5] == "x" * 50
+    assert lines[7] == "    \\input{z}"
+
+
+def test_auto_fix_file_source(tmp_path):
+    source = tmp_path / "doc.md"
+    source.write_text("\\usepackage{x}\n", encoding="utf-8")
+    ((_, fixed),), issues = preflight.check_documents([("doc.md", source)], auto_fix=True, work_dir=tmp_path)
+    assert isinstance(fixed, Path) and fixed != source
+    assert fixed.read_text(encoding="utf-8") == "\\\\usepackage{x}\n"
+    assert not any(issue.fatal for issue in issues)
+
+
+def test_auto_fix_keeps_clean_sources():
+    documents = [("doc.md", "# Fine\n")]
+    checked, issues = preflight.check_documents(documents, auto_fix=True)
+    assert checked == documents and issues == []
@@ -0,0 +1,124 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import processes
+from processes import Cancelled, JobScope, LimitExceeded
+
+
+pytestmark = pytest.mark.skipif(not processes.POSIX, reason="process groups and rlimits are POSIX only")
+
+BUSY_LOOP = [sys.executable, "-c", "while True: pass"]
+
+
+def _alive(pid):
+    """Whether pid is running (zombies waiting for a reaper do not count)."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+
+def test_run_captures_output_and_usage():
+    result = processes.run([sys.executable, "-c", "import sys; print(sys.stdin.read().upper())"], input="héllo")
+    assert result.returncode == 0
+    assert result.stdout.strip() == "HÉLLO"
+    assert result.elapsed > 0
+    if hasattr(os, "wait4"):
+        assert result.rusage is not None
+
+
+def test_run_charges_the_job_cpu_budget():
+    scope = JobScope(timeout=30, cpu_seconds=30, memory_bytes=None)
+    with processes.within(scope):
+        processes.run([sys.executable, "-c", "sum(range(3_000_000))"])
+    assert scope.cpu_left < 30
+
+
+def test_timeout_kills_the_process():
+    scope = JobScope(timeout=0.5, cpu_seconds=None, memory_bytes=None)
+    started = time.monotonic()
+    with processes.within(scope), pytest.raises(LimitExceeded) as raised:
+        processes.run(["sleep", "30"])
+    assert raised.value.cause == "timeout"
+    assert time.monotonic() - started < 10
+
+
+def test_deadline_is_shared_by_the_processes_of_a_job():
+    scope = JobScope(timeout=0.5, cpu_seconds=None, memory_bytes=None)
+    with processes.within(scope):
+        processes.run(["sleep", "0.3"])
+        time.sleep(0.3)
+        with pytest.raises(LimitExceeded) as raised:
+            processes.run(["true"])
+    assert raised.value.cause == "timeout"
+
+
+def test_timeout_kills_the_whole_process_group(tmp_path):
+    # Like pandoc starting xelatex: the grandchild must not outlive the limit
+    pid_file = tmp_path / "grandchild.pid"
+    scope = JobScope(timeout=0.5, cpu_seconds=None, memory_bytes=None)
+    with processes.within(scope), pytest.raises(LimitExceeded):
+        processes.run(["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"])
+    grandchild = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while _alive(grandchild) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(grandchild)
+
+
+@pytest.mark.skipif(processes.resource is None or not hasattr(processes.resource, "prlimit"), reason="needs prlimit")
+def test_cpu_limit_stops_a_busy_process():
+    scope = JobScope(timeout=30, cpu_seconds=1, memory_bytes=None)
+    with processes.within(scope), pytest.raises(LimitExceeded) as raised:
+        processes.run(BUSY_LOOP)
+    assert raised.value.cause == "cpu_limit"
+
+    # The budget is spent, so the job cannot start another process
+    with processes.within(scope), pytest.raises(LimitExceeded) as raised:
+        processes.run(["true"])
+    assert raised.value.cause == "cpu_limit"
+
+
+@pytest.mark.skipif(processes.PRLIMIT is None, reason="needs prlimit(1)")
+def test_limits_are_in_place_when_the_command_starts():
+    # An address-space cap set after exec would land below what pandoc already reserved
+    scope = JobScope(timeout=30, cpu_seconds=100, memory_bytes=256 * 1024 * 1024)
+    with processes.within(scope):
+        result = processes.run(["sh", "-c", "ulimit -v; ulimit -t"])
+    assert result.stdout.split() == [str(256 * 1024), "100"]
+    assert result.args == ["sh", "-c", "ulimit -v; ulimit -t"]
+
+
+def test_missing_executable_raises_file_not_found():
+    with pytest.raises(FileNotFoundError):
+        processes.run(["md2pdf-no-such-program"])
+
+
+def test_cancel_kills_the_running_process():
+    scope = JobScope(timeout=30, cpu_seconds=None, memory_bytes=None)
+    threading.Timer(0.3, scope.cancel).start()
+    started = time.monotonic()
+    with processes.within(scope), pytest.raises(Cancelled):
+        processes.run(["sleep", "30"])
+    assert time.monotonic() - started < 10
+
+
+def test_cancelled_scope_refuses_new_processes():
+    scope = JobScope(timeout=30, cpu_seconds=None, memory_bytes=None)
+    scope.cancel()
+    with processes.within(scope), pytest.raises(Cancelled):
+        processes.run(["true"])
+
+
+def test_scope_is_restored_after_within():
+    outer = JobScope()
+    with processes.within(outer):
+        with processes.within(JobScope()):
+            pass
+        assert processes.current() is outer
+    assert processes.current() is None
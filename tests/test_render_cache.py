@@ -0,0 +1,45 @@
+import os
+import time
+
+from render_cache import RenderCache
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = RenderCache(cache_dir=tmp_path, max_bytes=10, suffix=".bin")
+    cache.put("old", b"12345678")
+    _age(tmp_path / "old.bin", 60)
+    cache.put("new", b"12345678")
+    assert cache.get("old") is None
+    assert cache.get("new") == b"12345678"
+
+
+def test_recently_used_entries_are_kept(tmp_path):
+    cache = RenderCache(cache_dir=tmp_path, max_bytes=10, suffix=".bin", keep_seconds=300)
+    first = cache.put_file("first", _write(tmp_path / "a", b"12345678"))
+    cache.put("second", b"12345678")
+    # Over budget, but the first path may still be read by a running job
+    assert first.exists()
+
+    _age(first, 600)
+    cache.put("third", b"12345678")
+    assert not first.exists()
+    assert cache.get("third") == b"12345678"
+
+
+def test_get_path_renews_protection(tmp_path):
+    cache = RenderCache(cache_dir=tmp_path, max_bytes=10, suffix=".bin", keep_seconds=300)
+    cache.put("image", b"12345678")
+    _age(tmp_path / "image.bin", 600)
+    path = cache.get_path("image")
+    cache.put("other", b"12345678")
+    assert path.exists()
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return path
@@ -0,0 +1,264 @@
+import codecs
+import os
+import re
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+from urllib.parse import unquote
+
+import images
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:  # optional; installed alongside streamlit via requests
+    detect_charset = None
+
+
+CHUNK_SIZE = 64 * 1024
+# How much of a non-UTF-8 file is sampled to guess its encoding
+DETECTION_SAMPLE_BYTES = 256 * 1024
+FALLBACK_ENCODING = "cp1252"
+
+DEFAULT_MAX_FILE_MB = 10
+DEFAULT_MAX_TOTAL_MB = 50
+
+BUNDLE_EXTENSIONS = (".zip",)
+MARKDOWN_EXTENSIONS = (".md", ".markdown")
+
+# ![alt](target "title") and [ref]: target reference definitions
+INLINE_IMAGE_RE = re.compile(r"""(!\[[^\]]*\]\(\s*)(<[^>]*>|[^)\s]+)((?:\s+(?:"[^"]*"|'[^']*'))?\s*\))""")
+REFERENCE_RE = re.compile(r"^(\s{0,3}\[[^\]]+\]:\s*)(<[^>]*>|\S+)(.*)$")
+
+
+class UploadTooLarge(ValueError):
+    """Raised when uploads exceed the configured per-file or total size limit."""
+
+
+def _size_of(fileobj):
+    size = getattr(fileobj, "size", None)
+    if size is not None:
+        return size
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+class UploadLimits:
+    """Per-file and total upload size limits, checked before any conversion work starts."""
+
+    def __init__(self, max_file_bytes, max_total_bytes):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+
+    @classmethod
+    def from_env(cls):
+        max_file_mb = float(os.environ.get("MD2PDF_MAX_FILE_MB", DEFAULT_MAX_FILE_MB))
+        max_total_mb = float(os.environ.get("MD2PDF_MAX_TOTAL_MB", DEFAULT_MAX_TOTAL_MB))
+        return cls(int(max_file_mb * 1024 * 1024), int(max_total_mb * 1024 * 1024))
+
+    def check(self, files):
+        """Raise UploadTooLarge if any (name, fileobj) pair or their sum is over the limit."""
+
+        total = 0
+        for name, fileobj in files:
+            size = _size_of(fileobj)
+            # Bundles are checked per unpacked Markdown file instead (see check_bundle)
+            if size > self.max_file_bytes and not is_bundle(name):
+                raise UploadTooLarge(
+                    f"'{name}' is {size / 1024 / 1024:.1f} MB; the limit per file is "
+                    f"{self.max_file_bytes / 1024 / 1024:.0f} MB."
+                )
+            total += size
+
+        if total > self.max_total_bytes:
+            raise UploadTooLarge(
+                f"The selected files add up to {total / 1024 / 1024:.1f} MB; the limit is "
+                f"{self.max_total_bytes / 1024 / 1024:.0f} MB in total."
+            )
+
+    def check_bundle(self, name, members):
+        """Raise UploadTooLarge if the unpacked zip members would exceed the limits."""
+
+        for member in members:
+            if member.filename.lower().endswith(MARKDOWN_EXTENSIONS) and member.file_size > self.max_file_bytes:
+                raise UploadTooLarge(
+                    f"'{member.filename}' in '{name}' is {member.file_size / 1024 / 1024:.1f} MB; "
+                    f"the limit per file is {self.max_file_bytes / 1024 / 1024:.0f} MB."
+                )
+
+        # Checked against the unpacked size so zip bombs are rejected before extraction
+        total = sum(member.file_size for member in members)
+        if total > self.max_total_bytes:
+            raise UploadTooLarge(
+                f"'{name}' unpacks to {total / 1024 / 1024:.1f} MB; the limit is "
+                f"{self.max_total_bytes / 1024 / 1024:.0f} MB in total."
+            )
+
+
+def detect_encoding(fileobj):
+    """Guess the encoding of a file that is not valid UTF-8 from a sample of it."""
+
+    fileobj.seek(0)
+    sample = fileobj.read(DETECTION_SAMPLE_BYTES)
+    if detect_charset is not None:
+        match = detect_charset(sample).best()
+        if match is not None:
+            return match.encoding
+    return FALLBACK_ENCODING
+
+
+def _transcode(fileobj, out, encoding, errors):
+    fileobj.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        out.write(decoder.decode(chunk))
+    out.write(decoder.decode(b"", final=True))
+
+
+def spool_text(fileobj, dest_path):
+    """Stream a binary upload into dest_path as UTF-8, chunk by chunk.
+
+    Decodes incrementally as UTF-8 (dropping a BOM) and falls back to a detected
+    encoding for files that are not valid UTF-8. Returns the source encoding.
+    """
+
+    with open(dest_path, "w", encoding="utf-8", newline="") as out:
+        try:
+            _transcode(fileobj, out, "utf-8-sig", "strict")
+            return "utf-8"
+        except UnicodeDecodeError:
+            pass
+
+        encoding = detect_encoding(fileobj)
+        out.seek(0)
+        out.truncate()
+        _transcode(fileobj, out, encoding, "replace")
+        return encoding
+
+
+def is_bundle(name):
+    return name.lower().endswith(BUNDLE_EXTENSIONS)
+
+
+def _bundle_members(bundle):
+    """Regular files of a zip with safe relative paths, skipping macOS metadata."""
+
+    members = []
+    for member in bundle.infolist():
+        path = PurePosixPath(member.filename)
+        if member.is_dir() or path.is_absolute() or ".." in path.parts or "__MACOSX" in path.parts:
+            continue
+        if path.name.startswith("."):
+            continue
+        members.append(member)
+    return members
+
+
+def rewrite_image_links(md_path, resolve):
+    """Rewrite image targets in a Markdown file in place, line by line.
+
+    resolve(target) returns the replacement path or None to keep the target.
+    """
+
+    def replace_target(match):
+        target = match.group(2)
+        new_target = resolve(unquote(target.strip("<>")))
+        if new_target is None:
+            return match.group(0)
+        return f"{match.group(1)}<{new_target}>{match.group(3)}"
+
+    tmp_path = md_path.with_name(md_path.name + ".tmp")
+    with open(md_path, "r", encoding="utf-8", newline="") as src, \
+            open(tmp_path, "w", encoding="utf-8", newline="") as out:
+        for line in src:
+            line = INLINE_IMAGE_RE.sub(replace_target, line)
+            line = REFERENCE_RE.sub(replace_target, line)
+            out.write(line)
+    os.replace(tmp_path, md_path)
+
+
+def spool_bundle(name, fileobj, bundle_dir, limits=None, image_cache=None):
+    """Unpack a zip of Markdown files and their assets into bundle_dir.
+
+    Every Markdown file becomes a document (in path order). Local images they
+    reference are downscaled once (see images.prepare_image) and the links are
+    rewritten to the processed files. Returns (name, path) pairs.
+    """
+
+    bundle_dir = Path(bundle_dir)
+    assets_dir = bundle_dir / "assets"
+    with zipfile.ZipFile(fileobj) as bundle:
+        members = _bundle_members(bundle)
+        if limits is not None:
+            limits.check_bundle(name, members)
+
+        markdown = sorted(
+            (m for m in members if m.filename.lower().endswith(MARKDOWN_EXTENSIONS)),
+            key=lambda m: m.filename
+        )
+        if not markdown:
+            raise ValueError(f"'{name}' does not contain any Markdown files.")
+
+        markdown_names = {member.filename for member in markdown}
+        for member in members:
+            if member.filename in markdown_names:
+                continue
+            dest = assets_dir / member.filename
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with bundle.open(member) as src, open(dest, "wb") as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+
+        documents = []
+        for index, member in enumerate(markdown):
+            dest_path = bundle_dir / f"{index:04d}.md"
+            with bundle.open(member) as src:
+                spool_text(src, dest_path)
+
+            base = PurePosixPath(member.filename).parent
+
+            def resolve(target, base=base):
+                if "://" in target or target.startswith(("data:", "/", "#")):
+                    return None
+                relative = PurePosixPath(os.path.normpath(str(base / target)))
+                if ".." in relative.parts or not images.is_image(relative):
+                    return None
+                asset = assets_dir / relative
+                if not asset.is_file():
+                    return None
+                return images.prepare_image(asset, cache=image_cache, work_dir=bundle_dir).as_posix()
+
+            rewrite_image_links(dest_path, resolve)
+            documents.append((PurePosixPath(member.filename).name, dest_path))
+    return documents
+
+
+def spool_uploads(files, work_dir, limits=None, image_cache=None):
+    """Spool (name, fileobj) pairs into work_dir and return (name, path) pairs in the same order.
+
+    Zip bundles expand to one document per Markdown file they contain, with their
+    images processed and cached in image_cache. Size limits are checked for all
+    files before anything is written.
+    """
+
+    if limits is not None:
+        limits.check(files)
+
+    work_dir = Path(work_dir)
+    documents = []
+    for index, (name, fileobj) in enumerate(files):
+        if is_bundle(name):
+            bundle_dir = work_dir / f"{index:04d}"
+            bundle_dir.mkdir()
+            documents.extend(spool_bundle(name, fileobj, bundle_dir, limits, image_cache))
+            continue
+
+        # Index prefix keeps duplicate or unusual file names apart on disk
+        dest_path = work_dir / f"{index:04d}.md"
+        spool_text(fileobj, dest_path)
+        documents.append((name, dest_path))
+    return documents
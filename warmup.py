@@ -0,0 +1,93 @@
+"""Startup warmup for MD2PDF, run by serve.py in the server process before
+Streamlit starts, so what it loads stays in memory for the sessions.
+
+After a scale-from-zero boot the first render would otherwise pay for cold
+pandoc/xelatex binaries, TeX file lookups, fontconfig and the template
+preprocessing. The warmup processes the Eisvogel templates, scans the fonts,
+builds the highlighting macros and runs one small reference render (title page,
+code, table, TOC) so those caches are hot before the health check passes. It logs the time spent as
+one JSON line and never fails the container start.
+
+Set MD2PDF_WARMUP=0 to skip it.
+"""
+
+import json
+import os
+import sys
+import time
+
+import metrics
+from converter import PdfOptions, convert, highlighting_macros, warm_templates
+from fonts import get_registry
+
+
+REFERENCE_MARKDOWN = """# Warmup
+
+Reference document rendered once at startup with **bold**, *italic*, `code`
+and a [link](https://example.com).
+
+## Code
+
+```python
+def hello(name):
+    return f"Hello {name}"
+```
+
+## Table
+
+| Option | Value |
+|--------|-------|
+| Font   | Auto  |
+| Size   | 12pt  |
+"""
+
+
+def _uptime():
+    """Seconds since the machine booted, or None where /proc is unavailable."""
+    try:
+        with open("/proc/uptime", "r", encoding="utf-8") as f:
+            return round(float(f.read().split()[0]), 2)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def warm_up():
+    """Run every warmup step; returns the metrics trace of the steps."""
+
+    with metrics.trace() as trace:
+        with metrics.stage("templates"):
+            warm_templates()
+        with metrics.stage("fonts"):
+            get_registry()
+        with metrics.stage("highlighting"):
+            highlighting_macros()
+        # Same code path as a user render, so pandoc, xelatex, the TeX packages and
+        # the fonts of the default options are all loaded once
+        convert([("warmup.md", REFERENCE_MARKDOWN)], PdfOptions(title="Warmup", author="MD2PDF", toc=True))
+    return trace
+
+
+def main():
+    if os.environ.get("MD2PDF_WARMUP", "1").lower() in ("0", "false", "no", "off"):
+        return 0
+
+    started = time.perf_counter()
+    event = {"event": "warmup", "uptime_at_start": _uptime()}
+    try:
+        trace = warm_up()
+        event["status"] = "done"
+        event["stages"] = trace["stages"]
+    except Exception as e:
+        # A failed warmup only means the first user pays the cold start
+        event["status"] = "failed"
+        event["cause"] = metrics.failure_cause(e)
+        event["error"] = str(e)
+
+    event["seconds"] = round(time.perf_counter() - started, 3)
+    event["uptime_at_ready"] = _uptime()
+    metrics.logger.info(json.dumps(event, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())